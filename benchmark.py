@@ -0,0 +1,124 @@
+import argparse
+import itertools
+import json
+import sys
+import tempfile
+
+import generate_images
+import profiling
+from dataset_writers import IMAGE_FORMATS, create_writer
+
+DEFAULT_SAMPLES = 500
+DEFAULT_SEED = 0
+DEFAULT_REGRESSION_THRESHOLD = 0.10
+
+
+def run_benchmark(samples=DEFAULT_SAMPLES, workers=1, seed=DEFAULT_SEED, image_format='png',
+                  text_file=generate_images.TEXT_FILE, font_path=generate_images.FONT_PATH,
+                  bg_dir=generate_images.BACKGROUND_DIR):
+    """
+    รันงานชุดคงที่ (samples บรรทัดแรกของ text_file, seed คงที่) ผ่าน pipeline เต็ม
+    แล้วคืนสรุปเวลาแต่ละขั้นตอน ภาพถูกเขียนลงโฟลเดอร์ชั่วคราวและลบทิ้งหลังจบ
+
+    Args:
+        samples (int): จำนวนบรรทัดที่ใช้
+        workers (int): จำนวน process
+        seed (int): seed หลัก
+        image_format (str): รูปแบบการเข้ารหัสภาพ
+        text_file (str): ไฟล์ข้อความ
+        font_path (str): พาธไปยังไฟล์ฟอนต์ .ttf
+        bg_dir (str): โฟลเดอร์ภาพพื้นหลัง
+    Returns:
+        dict: สรุปจาก profiling.StageProfiler.summary() พร้อมค่าที่ใช้รัน
+    """
+    with open(text_file, 'r', encoding='utf-8') as f:
+        lines = list(itertools.islice(f, samples))
+    background_pool = generate_images.load_background_pool(bg_dir)
+    encoding = (image_format, generate_images.DEFAULT_QUALITY, generate_images.DEFAULT_PNG_COMPRESS_LEVEL)
+
+    profiler = profiling.StageProfiler()
+    with tempfile.TemporaryDirectory() as output_folder:
+        writer = create_writer('folder', output_folder)
+        try:
+            generate_images.generate_all(
+                lines, font_path, background_pool, writer, seed,
+                workers=workers, encoding=encoding, profiler=profiler,
+                # ไม่พิมพ์ทีละภาพ เพื่อให้ความเร็วที่วัดไม่รวมเวลาเขียนลง terminal
+                verbose=False,
+            )
+        finally:
+            writer.close()
+    profiler.finish()
+
+    summary = profiler.summary()
+    summary['config'] = {'samples': samples, 'workers': workers, 'seed': seed, 'image_format': image_format}
+    return summary
+
+
+def compare_summaries(baseline, current, threshold=DEFAULT_REGRESSION_THRESHOLD):
+    """
+    เทียบผล benchmark กับ baseline
+
+    Args:
+        baseline (dict): สรุปจากรอบก่อน
+        current (dict): สรุปจากรอบนี้
+        threshold (float): สัดส่วนที่ช้าลงได้ก่อนนับเป็น regression (0.10 = 10%)
+    Returns:
+        tuple: (lines, regressions) ข้อความเปรียบเทียบ และรายชื่อสิ่งที่ช้าลงเกิน threshold
+    """
+    lines = []
+    regressions = []
+
+    base_rate, rate = baseline['images_per_s'], current['images_per_s']
+    lines.append(f"throughput: {base_rate:.1f} -> {rate:.1f} ภาพ/s")
+    if base_rate > 0 and rate < base_rate * (1 - threshold):
+        regressions.append('throughput')
+
+    for name, stats in current['stages'].items():
+        base_stats = baseline['stages'].get(name)
+        if base_stats is None:
+            continue
+        base_p50, p50 = base_stats['p50_ms'], stats['p50_ms']
+        lines.append(f"{name:<16}p50 {base_p50:8.2f} -> {p50:8.2f} ms")
+        if base_p50 > 0 and p50 > base_p50 * (1 + threshold):
+            regressions.append(name)
+    return lines, regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="benchmark การสร้างภาพด้วยงานชุดคงที่จาก thai_dict_clean.txt")
+    parser.add_argument("--samples", type=int, default=DEFAULT_SAMPLES, help="จำนวนบรรทัดที่ใช้")
+    parser.add_argument("--workers", type=int, default=1, help="จำนวน process")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="seed หลัก")
+    parser.add_argument("--image-format", choices=IMAGE_FORMATS, default='png', help="รูปแบบการเข้ารหัสภาพ")
+    parser.add_argument("--json", default=None, metavar="PATH", help="บันทึกผลเป็น JSON")
+    parser.add_argument("--compare", default=None, metavar="PATH",
+                        help="เทียบกับผล JSON ของรอบก่อน (exit code 1 ถ้าช้าลงเกิน --threshold)")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_REGRESSION_THRESHOLD,
+                        help="สัดส่วนที่ช้าลงได้ก่อนนับเป็น regression")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    summary = run_benchmark(args.samples, args.workers, args.seed, args.image_format)
+    print(profiling.format_summary(summary))
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2, ensure_ascii=False)
+        print(f"บันทึกผลแล้ว: {args.json}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        lines, regressions = compare_summaries(baseline, summary, args.threshold)
+        print("\n".join(lines))
+        if regressions:
+            print(f"ช้าลงเกิน {args.threshold:.0%}: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,270 @@
+import glob
+import io
+import os
+import tarfile
+
+import numpy as np
+
+IMAGE_FORMATS = ('png', 'jpeg', 'webp', 'raw')
+IMAGE_EXTENSIONS = {'png': 'png', 'jpeg': 'jpg', 'webp': 'webp', 'raw': 'npy'}
+DEFAULT_PNG_COMPRESS_LEVEL = 6
+DEFAULT_QUALITY = 95
+DEFAULT_SHARD_SIZE = 1000
+DEFAULT_LMDB_MAP_SIZE = 1 << 40
+# FolderWriter fsync ไฟล์ที่ค้างอยู่ทุกกี่ไฟล์ (กรณีไม่มีใครเรียก flush เช่นโหมดไม่ streaming)
+FOLDER_SYNC_EVERY = 1000
+
+
+def encode_image(image, image_format='png', quality=DEFAULT_QUALITY, compress_level=DEFAULT_PNG_COMPRESS_LEVEL):
+    """
+    เข้ารหัสรูปภาพเป็น bytes ตามรูปแบบที่เลือก
+
+    Args:
+        image (PIL.Image.Image): รูปภาพ (RGBA หรือ RGB)
+        image_format (str): 'png', 'jpeg', 'webp' หรือ 'raw' (array uint8 RGB ในรูปแบบ .npy)
+        quality (int): คุณภาพสำหรับ jpeg/webp
+        compress_level (int): ระดับการบีบอัด PNG (0-9, ค่าน้อยเร็วกว่าแต่ไฟล์ใหญ่กว่า)
+    Returns:
+        tuple: (data, extension) ข้อมูลที่เข้ารหัสแล้วและนามสกุลไฟล์
+    """
+    buffer = io.BytesIO()
+    if image_format == 'png':
+        image.save(buffer, format='PNG', compress_level=compress_level)
+    elif image_format == 'jpeg':
+        # JPEG ไม่รองรับ alpha และพื้นหลังทึบอยู่แล้ว จึงแปลงเป็น RGB
+        image.convert('RGB').save(buffer, format='JPEG', quality=quality)
+    elif image_format == 'webp':
+        image.save(buffer, format='WEBP', quality=quality)
+    elif image_format == 'raw':
+        np.save(buffer, np.asarray(image.convert('RGB')))
+    else:
+        raise ValueError(f"ไม่รองรับรูปแบบภาพ: {image_format}")
+    return buffer.getvalue(), IMAGE_EXTENSIONS[image_format]
+
+
+class FolderWriter:
+    """
+    เขียนหนึ่งไฟล์ต่อหนึ่งภาพลงในโฟลเดอร์ (รูปแบบเดิม เช่น images/ก_1_BG.png)
+    """
+
+    def __init__(self, output_folder, resume_state=None):
+        self.output_folder = output_folder
+        os.makedirs(output_folder, exist_ok=True)
+        # ไฟล์ที่เขียนแล้วแต่ยังไม่ได้ fsync
+        self._unsynced = []
+
+    def write(self, name, data, extension, label):
+        """
+        Returns:
+            str: พาธที่ใช้อ้างอิงในไฟล์ label (เช่น images/ก_1_BG.png)
+        """
+        filename = f"{name}.{extension}"
+        path = os.path.join(self.output_folder, filename)
+        with open(path, 'wb') as f:
+            f.write(data)
+        self._unsynced.append(path)
+        if len(self._unsynced) >= FOLDER_SYNC_EVERY:
+            self._sync()
+        return os.path.join(os.path.basename(os.path.normpath(self.output_folder)), filename)
+
+    def _sync(self):
+        """fsync ไฟล์ที่ค้างอยู่และตัวโฟลเดอร์ (ให้ชื่อไฟล์ใหม่อยู่บนดิสก์ด้วย)"""
+        if not self._unsynced:
+            return
+        for path in self._unsynced:
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        self._unsynced = []
+        if hasattr(os, 'O_DIRECTORY'):  # Windows เปิดโฟลเดอร์เพื่อ fsync ไม่ได้
+            fd = os.open(self.output_folder, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def flush(self):
+        """
+        fsync ภาพที่เขียนตั้งแต่ครั้งก่อน ชื่อไฟล์ขึ้นกับดัชนีของภาพ การสร้างซ้ำหลัง resume
+        จึงเขียนทับไฟล์เดิม ไม่ต้องเก็บสถานะ
+        """
+        self._sync()
+        return {}
+
+    def close(self):
+        pass
+
+
+class TarShardWriter:
+    """
+    เขียนภาพและ label ลงไฟล์ tar แบ่งเป็น shard ละ shard_size ภาพ (รูปแบบเดียวกับ WebDataset:
+    แต่ละภาพมีสมาชิก <key>.<ext> และ <key>.txt)
+    """
+
+    def __init__(self, output_folder, shard_size=DEFAULT_SHARD_SIZE, resume_state=None):
+        """
+        Args:
+            output_folder (str): โฟลเดอร์สำหรับไฟล์ shard
+            shard_size (int): จำนวนภาพต่อ shard
+            resume_state (dict, optional): สถานะจาก flush() ของรอบก่อน (ใช้ตอน resume)
+                ถ้าไม่ระบุ shard เดิมทั้งหมดในโฟลเดอร์จะถูกลบ
+        """
+        self.output_folder = output_folder
+        self.shard_size = shard_size
+        os.makedirs(output_folder, exist_ok=True)
+
+        self.shard_index = 0
+        self.shard_count = 0
+        self._file = None
+        self._tar = None
+        # shard ของรอบก่อนที่ไม่มีภาพใน checkpoint ไม่อยู่ในไฟล์ label ใด แต่ glob shard-*.tar จะอ่านรวมเข้ามา
+        last_kept = -1
+        if resume_state:
+            last_kept = resume_state['shard'] if resume_state['count'] else resume_state['shard'] - 1
+        self._remove_shards(after=last_kept)
+        if resume_state:
+            # ตัด shard ล่าสุดกลับไปที่ตำแหน่งใน checkpoint แล้วเขียนต่อจากตรงนั้น
+            self.shard_index = resume_state['shard']
+            self.shard_count = resume_state['count']
+            if self.shard_count:
+                self._file = open(self._shard_path(self.shard_index), 'r+b')
+                self._file.truncate(resume_state['offset'])
+                self._file.seek(resume_state['offset'])
+                self._tar = tarfile.open(fileobj=self._file, mode='w')
+
+    def _shard_path(self, shard_index):
+        return os.path.join(self.output_folder, f"shard-{shard_index:06d}.tar")
+
+    def _remove_shards(self, after):
+        """ลบไฟล์ shard ที่มีลำดับมากกว่า after"""
+        for path in glob.glob(os.path.join(glob.escape(self.output_folder), "shard-*.tar")):
+            shard_number = os.path.basename(path)[len("shard-"):-len(".tar")]
+            if shard_number.isdigit() and int(shard_number) > after:
+                os.remove(path)
+
+    def _add_member(self, member_name, data):
+        info = tarfile.TarInfo(member_name)
+        info.size = len(data)
+        self._tar.addfile(info, io.BytesIO(data))
+
+    def _close_shard(self):
+        if self._tar is not None:
+            self._tar.close()
+            # shard ที่ปิดแล้วไม่ถูก flush อีก จึง fsync ก่อนปิด
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+        self._tar = None
+        self._file = None
+
+    def write(self, name, data, extension, label):
+        """
+        Returns:
+            str: พาธที่ใช้อ้างอิงในไฟล์ label ในรูปแบบ <shard>.tar/<key>
+        """
+        if self.shard_count >= self.shard_size:
+            self._close_shard()
+            self.shard_index += 1
+            self.shard_count = 0
+        if self._tar is None:
+            self._file = open(self._shard_path(self.shard_index), 'wb')
+            self._tar = tarfile.open(fileobj=self._file, mode='w')
+
+        self._add_member(f"{name}.{extension}", data)
+        self._add_member(f"{name}.txt", label.encode('utf-8'))
+        self.shard_count += 1
+        shard_name = os.path.basename(self._shard_path(self.shard_index))
+        return f"{os.path.basename(os.path.normpath(self.output_folder))}/{shard_name}/{name}"
+
+    def flush(self):
+        """
+        Returns:
+            dict: shard ปัจจุบัน, จำนวนภาพใน shard และตำแหน่งท้ายสมาชิกล่าสุด (ก่อน end-of-archive)
+        """
+        offset = 0
+        if self._tar is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            offset = self._tar.offset
+        return {'shard': self.shard_index, 'count': self.shard_count, 'offset': offset}
+
+    def close(self):
+        self._close_shard()
+
+
+class LmdbWriter:
+    """
+    เขียนภาพและ label ลง LMDB ด้วย key แบบเดียวกับชุดข้อมูล OCR ทั่วไป
+    (image-000000001, label-000000001 และ num-samples)
+
+    ต้องติดตั้งแพ็กเกจ lmdb เพิ่ม (pip install lmdb)
+    """
+
+    def __init__(self, output_path, map_size=DEFAULT_LMDB_MAP_SIZE, resume_state=None):
+        """
+        Args:
+            output_path (str): โฟลเดอร์ของฐานข้อมูล LMDB
+            map_size (int): ขนาดสูงสุดของฐานข้อมูล (byte)
+            resume_state (dict, optional): สถานะจาก flush() ของรอบก่อน (ใช้ตอน resume)
+                ถ้าไม่ระบุ ข้อมูลเดิมทั้งหมดในฐานข้อมูลจะถูกลบ
+        """
+        try:
+            import lmdb
+        except ImportError as e:
+            raise ImportError("ต้องติดตั้ง lmdb ก่อนใช้ --output-format lmdb (pip install lmdb)") from e
+
+        self.output_path = output_path
+        self.env = lmdb.open(output_path, map_size=map_size)
+        # entry ที่เขียนหลัง checkpoint จะถูกเขียนทับ เพราะนับต่อจาก count ใน checkpoint
+        self.count = resume_state['count'] if resume_state else 0
+        self._txn = self.env.begin(write=True)
+        if not resume_state:
+            # ไม่ให้ key image-/label- ของรอบก่อนที่เกิน num-samples ใหม่ค้างอยู่
+            self._txn.drop(self.env.open_db(), delete=False)
+
+    def write(self, name, data, extension, label):
+        """
+        Returns:
+            str: key ของภาพ (เช่น image-000000001) ใช้อ้างอิงในไฟล์ label
+        """
+        self.count += 1
+        image_key = f"image-{self.count:09d}"
+        self._txn.put(image_key.encode(), data)
+        self._txn.put(f"label-{self.count:09d}".encode(), label.encode('utf-8'))
+        return image_key
+
+    def flush(self):
+        """commit transaction ปัจจุบัน แล้วคืนจำนวนภาพทั้งหมด"""
+        self._txn.put(b"num-samples", str(self.count).encode())
+        self._txn.commit()
+        self.env.sync()
+        self._txn = self.env.begin(write=True)
+        return {'count': self.count}
+
+    def close(self):
+        self.flush()
+        self._txn.abort()
+        self.env.close()
+
+
+def create_writer(output_format, output_path, shard_size=DEFAULT_SHARD_SIZE, resume_state=None):
+    """
+    สร้าง writer ตามรูปแบบเอาต์พุต
+
+    Args:
+        output_format (str): 'folder', 'tar' หรือ 'lmdb'
+        output_path (str): โฟลเดอร์/ฐานข้อมูลปลายทาง
+        shard_size (int): จำนวนภาพต่อ shard (เฉพาะ 'tar')
+        resume_state (dict, optional): สถานะจาก flush() ของรอบก่อน
+    Returns:
+        FolderWriter | TarShardWriter | LmdbWriter: writer ที่สร้างแล้ว
+    """
+    if output_format == 'folder':
+        return FolderWriter(output_path, resume_state=resume_state)
+    if output_format == 'tar':
+        return TarShardWriter(output_path, shard_size=shard_size, resume_state=resume_state)
+    if output_format == 'lmdb':
+        return LmdbWriter(output_path, resume_state=resume_state)
+    raise ValueError(f"ไม่รองรับรูปแบบเอาต์พุต: {output_format}")
@@ -0,0 +1,174 @@
+import json
+import os
+
+from PIL import ImageFont
+
+# ขนาดฟอนต์ที่ใช้วัดตาราง ค่าที่ขนาดอื่นได้จากการคูณสัดส่วน (ขนาดข้อความแปรผันเกือบเป็นเส้นตรงกับขนาดฟอนต์)
+REFERENCE_SIZE = 100
+# code point ที่ไม่มีฟอนต์ใดมี glyph ใช้สร้าง glyph .notdef (กล่องสี่เหลี่ยม) ไว้เทียบ
+_MISSING_CODE_POINT = '\U0010FFFD'
+
+
+class FontMetrics:
+    """
+    ตารางขนาดของฟอนต์หนึ่งไฟล์ที่วัดไว้ครั้งเดียวที่ REFERENCE_SIZE: ระยะเลื่อน (advance width) และกรอบหมึก
+    ของแต่ละตัวอักษร, ascent/descent และรายการตัวอักษรที่ฟอนต์ไม่มี glyph
+    ใช้ประมาณขนาดข้อความแทนการวัดด้วย textbbox และคัดคำที่ฟอนต์แสดงไม่ได้ออกก่อนสร้างภาพ
+    """
+
+    def __init__(self, font_path, glyphs, missing, ascent, descent, reference_size=REFERENCE_SIZE, signature=None):
+        """
+        Args:
+            font_path (str): พาธไปยังไฟล์ฟอนต์
+            glyphs (dict): ตัวอักษร -> (advance, left, top, right, bottom) ที่ reference_size
+                (กรอบหมึกเป็น None ถ้าตัวอักษรไม่มีหมึก เช่นช่องว่าง)
+            missing (set): ตัวอักษรที่ฟอนต์ไม่มี glyph
+            ascent (int): ascent ของฟอนต์ที่ reference_size
+            descent (int): descent ของฟอนต์ที่ reference_size
+            reference_size (int): ขนาดฟอนต์ที่ใช้วัด
+            signature (list, optional): [ขนาดไฟล์, mtime] ของไฟล์ฟอนต์ตอนวัด ใช้ตรวจว่า cache ยังใช้ได้
+        """
+        self.font_path = font_path
+        self.glyphs = glyphs
+        self.missing = set(missing)
+        self.ascent = ascent
+        self.descent = descent
+        self.reference_size = reference_size
+        self.signature = signature
+
+    @classmethod
+    def measure(cls, font_path, characters, reference_size=REFERENCE_SIZE):
+        """
+        วัดตารางของตัวอักษรที่กำหนดด้วย FreeType (ทำครั้งเดียวตอนเริ่มงาน)
+
+        Args:
+            font_path (str): พาธไปยังไฟล์ฟอนต์
+            characters (iterable[str]): ตัวอักษรที่ต้องการวัด เช่นทุกตัวอักษรในไฟล์ข้อความ
+            reference_size (int): ขนาดฟอนต์ที่ใช้วัด
+        Returns:
+            FontMetrics: ตารางของฟอนต์
+        """
+        font = ImageFont.truetype(font_path, reference_size)
+        ascent, descent = font.getmetrics()
+        metrics = cls(font_path, {}, set(), ascent, descent, reference_size, _file_signature(font_path))
+        metrics.add_characters(characters, font)
+        return metrics
+
+    def add_characters(self, characters, font=None):
+        """
+        วัดเพิ่มเฉพาะตัวอักษรที่ยังไม่อยู่ในตาราง (ใช้เมื่อ cache ถูกสร้างจากข้อความชุดอื่น)
+
+        Args:
+            characters (iterable[str]): ตัวอักษรที่ต้องการ
+            font (PIL.ImageFont.FreeTypeFont, optional): ฟอนต์ที่ reference_size ถ้าโหลดไว้แล้ว
+        Returns:
+            int: จำนวนตัวอักษรที่วัดเพิ่ม
+        """
+        new_characters = sorted(set(characters) - self.glyphs.keys() - self.missing)
+        if not new_characters:
+            return 0
+        if font is None:
+            font = ImageFont.truetype(self.font_path, self.reference_size)
+
+        notdef_mask = font.getmask(_MISSING_CODE_POINT)
+        notdef = (notdef_mask.size, bytes(notdef_mask))
+        for character in new_characters:
+            mask = font.getmask(character)
+            # ตัวอักษรที่ไม่มีใน cmap ถูกวาดเป็น glyph .notdef (ยกเว้นช่องว่างที่ไม่มีหมึกอยู่แล้ว)
+            if not character.isspace() and (mask.size, bytes(mask)) == notdef:
+                self.missing.add(character)
+                continue
+            left, top, right, bottom = font.getbbox(character)
+            ink = (left, top, right, bottom) if right > left and bottom > top else None
+            self.glyphs[character] = (font.getlength(character),) + (ink or (None, None, None, None))
+        return len(new_characters)
+
+    def can_render(self, text):
+        """ฟอนต์มี glyph ครบทุกตัวอักษรของข้อความหรือไม่ (ตัวอักษรที่ยังไม่ได้วัดถือว่าไม่มี)"""
+        return all(character in self.glyphs for character in text)
+
+    def text_bbox(self, text, font_size):
+        """
+        ประมาณ textbbox ของข้อความจากตาราง โดยเลื่อนปากกาตาม advance ของแต่ละตัวอักษร
+        แบบเดียวกับ basic layout ของ PIL แล้วคูณสัดส่วนเป็นขนาด font_size
+
+        Args:
+            text (str): ข้อความ (ทุกตัวอักษรต้องอยู่ในตาราง)
+            font_size (int): ขนาดฟอนต์
+        Returns:
+            tuple: (left, top, right, bottom) เป็นจำนวนเต็ม
+        """
+        pen = 0.0
+        left = top = float('inf')
+        right = bottom = float('-inf')
+        for character in text:
+            advance, glyph_left, glyph_top, glyph_right, glyph_bottom = self.glyphs[character]
+            if glyph_left is not None:
+                left = min(left, pen + glyph_left)
+                top = min(top, glyph_top)
+                right = max(right, pen + glyph_right)
+                bottom = max(bottom, glyph_bottom)
+            pen += advance
+        if left == float('inf'):
+            return 0, 0, 0, 0
+        scale = font_size / self.reference_size
+        return (int(left * scale), int(top * scale), int(round(right * scale)), int(round(bottom * scale)))
+
+    def to_dict(self):
+        return {
+            'font_path': self.font_path,
+            'reference_size': self.reference_size,
+            'signature': self.signature,
+            'ascent': self.ascent,
+            'descent': self.descent,
+            'glyphs': self.glyphs,
+            'missing': sorted(self.missing),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        glyphs = {character: tuple(values) for character, values in data['glyphs'].items()}
+        return cls(data['font_path'], glyphs, data['missing'], data['ascent'], data['descent'],
+                   data['reference_size'], data['signature'])
+
+
+def _file_signature(path):
+    stat = os.stat(path)
+    return [stat.st_size, int(stat.st_mtime)]
+
+
+def build_metrics_index(font_paths, characters, cache_path=None):
+    """
+    สร้างตารางของทุกฟอนต์ ถ้าระบุ cache_path จะใช้ตารางเดิมจากไฟล์ (เมื่อไฟล์ฟอนต์ไม่เปลี่ยน)
+    วัดเพิ่มเฉพาะตัวอักษรใหม่ แล้วบันทึกกลับลงไฟล์
+
+    Args:
+        font_paths (list[str]): พาธไฟล์ฟอนต์
+        characters (iterable[str]): ตัวอักษรทั้งหมดในข้อความต้นทาง
+        cache_path (str, optional): ไฟล์ JSON สำหรับเก็บตาราง
+    Returns:
+        dict: font_path -> FontMetrics
+    """
+    characters = set(characters)
+    cached = {}
+    if cache_path is not None and os.path.exists(cache_path):
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            cached = {path: FontMetrics.from_dict(data) for path, data in json.load(f).items()}
+
+    index = {}
+    changed = False
+    for font_path in font_paths:
+        metrics = cached.get(font_path)
+        if (metrics is None or metrics.reference_size != REFERENCE_SIZE
+                or metrics.signature != _file_signature(font_path)):
+            metrics = FontMetrics.measure(font_path, characters)
+            changed = True
+        elif metrics.add_characters(characters):
+            changed = True
+        index[font_path] = metrics
+
+    if cache_path is not None and changed:
+        cached.update(index)
+        with open(cache_path, 'w', encoding='utf-8') as f:
+            json.dump({path: metrics.to_dict() for path, metrics in cached.items()}, f, ensure_ascii=False)
+    return index
@@ -2,310 +2,1359 @@ from PIL import Image, ImageDraw, ImageFont, ImageFilter
 import os
 import random
 import math
+import argparse
+import collections
+import dataclasses
+import functools
+import hashlib
+import itertools
+import json
+import multiprocessing
+import threading
+import time
 
-def generate_image_with_obstacles(text_line, font_path, background_image_path, output_folder, image_index):
+import numpy as np
+
+try:
+    from torch.utils.data import IterableDataset, get_worker_info
+except ImportError:  # ไม่ได้ติดตั้ง PyTorch: ใช้ ThaiTextImageDataset เป็น iterable ธรรมดา
+    IterableDataset = object
+    get_worker_info = None
+
+import profiling
+from dataset_writers import (
+    DEFAULT_PNG_COMPRESS_LEVEL,
+    DEFAULT_QUALITY,
+    DEFAULT_SHARD_SIZE,
+    IMAGE_FORMATS,
+    create_writer,
+    encode_image,
+)
+
+
+FONT_CACHE_SIZE = 512
+MAX_FONT_SIZE = 200
+MIN_FONT_SIZE = 5
+FONT_SIZE_STEP = 5
+TEXT_MASK_CACHE_BYTES = 128 * 1024 * 1024
+TEXT_MASK_SIZE_BUCKET = 2
+# ขอบโปร่งใสรอบข้อความบน canvas สำหรับ kernel ของ bicubic resample
+RESAMPLE_MARGIN = 2
+# จำนวนครั้งสูงสุดที่ ThaiTextImageDataset สุ่มคำใหม่เมื่อข้อความมองไม่เห็น
+MAX_SAMPLE_ATTEMPTS = 100
+
+# ใช้ร่วมกันสำหรับวัดขนาดข้อความด้วย textbbox โดยไม่ต้องสร้างภาพใหม่ทุกครั้ง
+_measure_draw = ImageDraw.Draw(Image.new('RGBA', (1, 1)))
+
+# ตารางขนาดของฟอนต์ (font_path -> font_metrics.FontMetrics) ที่วัดไว้ตอนเริ่มงาน
+# ถ้ามีตารางของฟอนต์นั้น fit_font_size จะประมาณขนาดข้อความจากตารางแทนการ layout ด้วย FreeType
+_font_metrics = {}
+
+
+@functools.lru_cache(maxsize=FONT_CACHE_SIZE)
+def get_font(font_path, font_size):
+    """
+    โหลด FreeTypeFont พร้อม cache แบบ LRU ตาม (font_path, font_size)
+    แต่ละ process ใน pool มี cache ของตัวเอง จึงไม่ต้องแชร์ object ข้าม process
+
+    Args:
+        font_path (str): พาธไปยังไฟล์ฟอนต์ .ttf
+        font_size (int): ขนาดฟอนต์
+    Returns:
+        PIL.ImageFont.FreeTypeFont: ฟอนต์ที่โหลดแล้ว
+    """
+    return ImageFont.truetype(font_path, font_size)
+
+
+def fit_font_size(font_path, text_line, font_size, max_dimension,
+                  max_font_size=MAX_FONT_SIZE, min_font_size=MIN_FONT_SIZE):
+    """
+    หาขนาดฟอนต์ที่ข้อความกว้าง/สูงไม่เกิน max_dimension โดยคำนวณจากการวัดครั้งเดียว
+    (ขนาดข้อความแปรผันเกือบเป็นเส้นตรงกับขนาดฟอนต์) แล้วตรวจสอบซ้ำอีกครั้ง
+
+    Args:
+        font_path (str): พาธไปยังไฟล์ฟอนต์ .ttf
+        text_line (str): ข้อความที่จะวัด
+        font_size (int): ขนาดฟอนต์เริ่มต้นที่สุ่มได้
+        max_dimension (float): ความกว้าง/สูงสูงสุดที่ยอมรับได้
+        max_font_size (int): ขนาดฟอนต์สูงสุด (เผื่อพื้นที่สำหรับการหมุนและการบิดเบือน)
+        min_font_size (int): ขนาดฟอนต์ต่ำสุด
+    Returns:
+        tuple: (font, bbox) ฟอนต์ที่ได้และ textbbox ของข้อความที่ขนาดนั้น (ประมาณจากตารางถ้ามี)
+    """
+    # ลดลงทีละ FONT_SIZE_STEP จนไม่เกิน max_font_size แบบเดียวกับลูปเดิม เพื่อให้การกระจายของขนาดเหมือนเดิม
+    if font_size > max_font_size:
+        font_size -= FONT_SIZE_STEP * math.ceil((font_size - max_font_size) / FONT_SIZE_STEP)
+    font_size = max(font_size, min_font_size)
+
+    metrics = _font_metrics.get(font_path)
+    if metrics is not None and metrics.can_render(text_line):
+        def measure(size):
+            return metrics.text_bbox(text_line, size)
+    else:
+        def measure(size):
+            return _measure_draw.textbbox((0, 0), text_line, font=get_font(font_path, size))
+
+    bbox = measure(font_size)
+    extent = max(bbox[2] - bbox[0], bbox[3] - bbox[1])
+
+    # ถ้าเกิน ให้คำนวณขนาดเป้าหมายโดยตรง ส่วนรอบที่สองมีไว้แก้ความคลาดเคลื่อนจาก hinting เท่านั้น
+    for _ in range(2):
+        if extent <= max_dimension or font_size <= min_font_size:
+            break
+        font_size = max(min_font_size, min(font_size - 1, int(font_size * max_dimension / extent)))
+        bbox = measure(font_size)
+        extent = max(bbox[2] - bbox[0], bbox[3] - bbox[1])
+    return get_font(font_path, font_size), bbox
+
+
+def set_font_metrics(index):
+    """
+    ตั้งตารางขนาดฟอนต์ที่ fit_font_size ใช้ใน process ปัจจุบัน
+
+    Args:
+        index (dict): font_path -> font_metrics.FontMetrics (None = ไม่ใช้ตาราง)
+    """
+    global _font_metrics
+    _font_metrics = dict(index or {})
+
+
+class TextMaskCache:
+    """
+    cache แบบ LRU ของ mask ตัวหนังสือ (ภาพโหมด L ที่ครอบพอดีข้อความ) จำกัดขนาดรวมเป็น byte
+    แต่ละ process มี cache ของตัวเอง
+    """
+
+    def __init__(self, max_bytes=TEXT_MASK_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._masks = collections.OrderedDict()
+
+    def get(self, key):
+        mask = self._masks.get(key)
+        if mask is not None:
+            self._masks.move_to_end(key)
+        return mask
+
+    def put(self, key, mask):
+        size = mask.width * mask.height
+        if size > self.max_bytes:
+            return
+        self._masks[key] = mask
+        self.current_bytes += size
+        while self.current_bytes > self.max_bytes:
+            _, evicted = self._masks.popitem(last=False)
+            self.current_bytes -= evicted.width * evicted.height
+
+    def __len__(self):
+        return len(self._masks)
+
+
+_text_mask_cache = TextMaskCache()
+
+
+def set_text_mask_cache_size(max_bytes):
+    """เปลี่ยนขนาดสูงสุดของ cache mask ตัวหนังสือใน process ปัจจุบัน (ล้าง cache เดิม)"""
+    global _text_mask_cache
+    _text_mask_cache = TextMaskCache(max_bytes)
+
+
+def bucket_font_size(font_size):
+    """ปัดขนาดฟอนต์ลงเป็นช่วงละ TEXT_MASK_SIZE_BUCKET เพื่อให้ mask ใน cache ถูกใช้ซ้ำได้บ่อยขึ้น"""
+    return max(MIN_FONT_SIZE, font_size - font_size % TEXT_MASK_SIZE_BUCKET)
+
+
+def get_text_mask(text_line, font_path, font_size):
+    """
+    คืน mask ของข้อความ (โหมด L ขนาดพอดี textbbox) จาก cache หรือเรนเดอร์ใหม่ถ้ายังไม่มี
+    ภาพที่คืนมาถูกแชร์ใน cache ห้ามแก้ไขโดยตรง
+
+    Args:
+        text_line (str): ข้อความ
+        font_path (str): พาธไปยังไฟล์ฟอนต์ .ttf
+        font_size (int): ขนาดฟอนต์
+    Returns:
+        PIL.Image.Image: mask โหมด L
+    """
+    key = (text_line, font_path, font_size)
+    mask = _text_mask_cache.get(key)
+    if mask is None:
+        font = get_font(font_path, font_size)
+        bbox = _measure_draw.textbbox((0, 0), text_line, font=font)
+        mask = Image.new('L', (max(1, bbox[2] - bbox[0]), max(1, bbox[3] - bbox[1])), 0)
+        ImageDraw.Draw(mask).text((-bbox[0], -bbox[1]), text_line, font=font, fill=255)
+        _text_mask_cache.put(key, mask)
+    return mask
+
+
+def _affine_matrix(a, b, c, d, e, f):
+    """สร้าง matrix 3x3 จากค่าสัมประสิทธิ์ affine 6 ตัวแบบเดียวกับ Image.Transform.AFFINE"""
+    return np.array([[a, b, c], [d, e, f], [0.0, 0.0, 1.0]])
+
+
+def _apply_homography(matrix, points):
+    """แปลงรายการจุด (x, y) ด้วย matrix 3x3"""
+    points = np.asarray(points, dtype=float)
+    projected = np.hstack([points, np.ones((len(points), 1))]) @ matrix.T
+    return projected[:, :2] / projected[:, 2:3]
+
+
+def _transformed_bounds(matrix, size, origin=(0, 0)):
+    """หากรอบ (left, top, right, bottom) ของสี่เหลี่ยมขนาด size ที่มุมซ้ายบนอยู่ที่ origin หลังแปลงด้วย matrix"""
+    x0, y0 = origin
+    x1, y1 = x0 + size[0], y0 + size[1]
+    corners = _apply_homography(matrix, [(x0, y0), (x1, y0), (x1, y1), (x0, y1)])
+    left, top = corners.min(axis=0)
+    right, bottom = corners.max(axis=0)
+    return left, top, right, bottom
+
+
+def perspective_from_quads(src_quad, dst_quad):
+    """
+    หา homography 3x3 ที่แปลงจุด 4 มุมของ src_quad ไปเป็น dst_quad
+
+    Args:
+        src_quad (list): จุด (x, y) 4 จุดต้นทาง
+        dst_quad (list): จุด (x, y) 4 จุดปลายทาง ตามลำดับเดียวกัน
+    Returns:
+        numpy.ndarray: matrix 3x3 (source -> destination)
+    """
+    rows = []
+    values = []
+    for (x, y), (u, v) in zip(src_quad, dst_quad):
+        rows.append([x, y, 1, 0, 0, 0, -u * x, -u * y])
+        rows.append([0, 0, 0, x, y, 1, -v * x, -v * y])
+        values.extend([u, v])
+    coeffs = np.linalg.solve(np.array(rows, dtype=float), np.array(values, dtype=float))
+    return np.append(coeffs, 1.0).reshape(3, 3)
+
+
+def z_tilt_matrix(bounds, direction, scale):
+    """
+    สร้าง perspective matrix ที่ทำให้ด้านหนึ่งของกรอบหดลงเหลือ scale เท่า (จำลองการเอียงแกน Z)
+
+    Args:
+        bounds (tuple): กรอบ (left, top, right, bottom) ของเนื้อหาที่จะเอียง
+        direction (str): 'top_smaller', 'bottom_smaller', 'left_smaller' หรือ 'right_smaller'
+        scale (float): สัดส่วนความยาวของด้านที่หดเทียบกับด้านตรงข้าม
+    Returns:
+        numpy.ndarray: matrix 3x3 (source -> destination)
+    """
+    left, top, right, bottom = bounds
+    src_quad = [(left, top), (right, top), (right, bottom), (left, bottom)]
+    dst_quad = list(src_quad)
+    inset_x = (right - left) * (1.0 - scale) / 2
+    inset_y = (bottom - top) * (1.0 - scale) / 2
+
+    if direction == 'top_smaller':
+        dst_quad[0] = (left + inset_x, top)
+        dst_quad[1] = (right - inset_x, top)
+    elif direction == 'bottom_smaller':
+        dst_quad[3] = (left + inset_x, bottom)
+        dst_quad[2] = (right - inset_x, bottom)
+    elif direction == 'left_smaller':
+        dst_quad[0] = (left, top + inset_y)
+        dst_quad[3] = (left, bottom - inset_y)
+    elif direction == 'right_smaller':
+        dst_quad[1] = (right, top + inset_y)
+        dst_quad[2] = (right, bottom - inset_y)
+    else:
+        raise ValueError(f"ไม่รู้จักทิศทางการเอียง: {direction}")
+    return perspective_from_quads(src_quad, dst_quad)
+
+
+def warp_with_matrix(image, matrix, resample=Image.Resampling.BICUBIC, margin=0, fillcolor=(0, 0, 0, 0)):
+    """
+    แปลงภาพด้วย matrix 3x3 (source -> destination) ด้วยการ resample ครั้งเดียว
+    โดยขยาย canvas ปลายทางให้ครอบคลุมภาพทั้งหมดหลังแปลง (คล้าย expand=True ของ rotate)
+
+    Args:
+        image (PIL.Image.Image): ภาพต้นทาง
+        matrix (numpy.ndarray): matrix 3x3 (source -> destination)
+        resample: วิธี resample ของ PIL
+        margin (int): ขอบว่างเพิ่มรอบภาพปลายทาง (เช่นเผื่อให้เบลอกระจายออกได้ไม่ขาด)
+        fillcolor (tuple): สีของพื้นที่นอกภาพต้นทาง
+    Returns:
+        PIL.Image.Image: ภาพหลังแปลง
+    """
+    left, top, right, bottom = _transformed_bounds(matrix, image.size)
+    left, top = math.floor(left) - margin, math.floor(top) - margin
+    out_size = (max(1, math.ceil(right) + margin - left), max(1, math.ceil(bottom) + margin - top))
+
+    # Image.Transform.PERSPECTIVE ต้องการ matrix ปลายทาง -> ต้นทาง จึงต้อง invert
+    inverse = np.linalg.inv(_affine_matrix(1, 0, -left, 0, 1, -top) @ matrix)
+    inverse = inverse / inverse[2, 2]
+    return image.transform(
+        out_size,
+        Image.Transform.PERSPECTIVE,
+        tuple(inverse.flatten()[:8]),
+        resample=resample,
+        fillcolor=fillcolor,
+    )
+
+
+BACKGROUND_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+BACKGROUND_SIZE = (400, 400)
+
+
+class BackgroundPool:
+    """
+    คลังภาพพื้นหลังที่ถอดรหัสและปรับขนาดไว้ล่วงหน้าในหน่วยความจำ เก็บเป็น array uint8 รูปร่าง (N, H, W, 3)
+    เพื่อไม่ต้องเปิดไฟล์/decode JPEG/resize ใหม่ทุกภาพ
+
+    ถ้าโหลดจากไฟล์ cache (.npy) จะใช้ memory-map ทำให้ทุก process ใน pool อ่านข้อมูลชุดเดียวกันได้
+    โดยไม่ต้องคัดลอก ส่วนกรณีใช้ fork ตัว array ในหน่วยความจำก็ถูกแชร์แบบ copy-on-write อยู่แล้ว
+    """
+
+    def __init__(self, images, target_size=BACKGROUND_SIZE, cache_path=None):
+        """
+        Args:
+            images (numpy.ndarray): array uint8 รูปร่าง (N, H, W, 3) โดย H, W ต้องไม่เล็กกว่า target_size
+            target_size (tuple): ขนาด (width, height) ของพื้นหลังที่ sample() คืนให้
+            cache_path (str, optional): พาธไฟล์ .npy ที่ images ถูก memory-map มา (ถ้ามี)
+        """
+        if len(images) == 0:
+            raise ValueError("คลังภาพพื้นหลังว่างเปล่า")
+        if images.shape[2] < target_size[0] or images.shape[1] < target_size[1]:
+            raise ValueError(f"ภาพพื้นหลังในคลัง ({images.shape[2]}x{images.shape[1]}) เล็กกว่าขนาดเป้าหมาย {target_size}")
+        self.images = images
+        self.target_size = target_size
+        self.cache_path = cache_path
+
+    @classmethod
+    def from_directory(cls, directory, target_size=BACKGROUND_SIZE, crop_scale=1.0):
+        """
+        โหลดทุกภาพในโฟลเดอร์ครั้งเดียว แล้วปรับขนาดเป็น target_size * crop_scale
+
+        Args:
+            directory (str | list[str]): โฟลเดอร์ภาพพื้นหลัง (หรือรายการโฟลเดอร์ที่จะรวมเป็นคลังเดียว)
+            target_size (tuple): ขนาดพื้นหลังที่ต้องการ
+            crop_scale (float): ถ้ามากกว่า 1 จะเก็บภาพใหญ่กว่าเป้าหมาย เพื่อให้สุ่มตำแหน่ง crop ได้
+        Returns:
+            BackgroundPool: คลังภาพพื้นหลัง
+        """
+        stored_size = (int(target_size[0] * crop_scale), int(target_size[1] * crop_scale))
+        paths = cls.list_files(directory)
+        if not paths:
+            raise FileNotFoundError(f"ไม่พบภาพพื้นหลังในโฟลเดอร์ '{directory}'")
+
+        images = np.empty((len(paths), stored_size[1], stored_size[0], 3), dtype=np.uint8)
+        for i, path in enumerate(paths):
+            with Image.open(path) as image:
+                images[i] = np.asarray(image.convert("RGB").resize(stored_size, Image.Resampling.LANCZOS))
+        return cls(images, target_size)
+
+    @staticmethod
+    def list_files(directory):
+        """
+        Args:
+            directory (str | list[str]): โฟลเดอร์ภาพพื้นหลัง (หรือรายการโฟลเดอร์)
+        Returns:
+            list[str]: พาธภาพพื้นหลังทั้งหมดเรียงตามชื่อ (ลำดับเดียวกับภาพในคลัง)
+        """
+        directories = [directory] if isinstance(directory, str) else list(directory)
+        return sorted(
+            os.path.join(folder, name) for folder in directories for name in os.listdir(folder)
+            if name.lower().endswith(BACKGROUND_EXTENSIONS)
+        )
+
+    @classmethod
+    def load(cls, cache_path, target_size=BACKGROUND_SIZE):
+        """โหลดคลังจากไฟล์ .npy แบบ memory-map (อ่านอย่างเดียว)"""
+        return cls(np.load(cache_path, mmap_mode='r'), target_size, cache_path=cache_path)
+
+    def save(self, cache_path):
+        """บันทึกคลังเป็นไฟล์ .npy เพื่อให้ load() แบบ memory-map ได้ในรอบถัดไป"""
+        np.save(cache_path, np.ascontiguousarray(self.images))
+
+    def __len__(self):
+        return len(self.images)
+
+    def __getstate__(self):
+        # ถ้ามีไฟล์ cache ให้ส่งแค่พาธ แล้วให้ process ปลายทาง memory-map เอง แทนการ pickle ทั้ง array
+        if self.cache_path is not None:
+            return {'images': None, 'target_size': self.target_size, 'cache_path': self.cache_path}
+        return self.__dict__.copy()
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.images is None:
+            self.images = np.load(self.cache_path, mmap_mode='r')
+
+    def sample(self, rng, random_offset=True):
+        """
+        สุ่มภาพพื้นหลังจากคลัง พร้อมสุ่มตำแหน่ง crop ขนาด target_size (ถ้าภาพในคลังใหญ่กว่า)
+
+        Args:
+            rng (random.Random): ตัวสุ่ม
+            random_offset (bool): ถ้า False จะ crop ตรงกลางภาพ
+        Returns:
+            PIL.Image.Image: ภาพพื้นหลังโหมด RGB ขนาด target_size
+        """
+        index = rng.randrange(len(self.images))
+        stored_height, stored_width = self.images.shape[1:3]
+        target_width, target_height = self.target_size
+        if random_offset:
+            x = rng.randint(0, stored_width - target_width)
+            y = rng.randint(0, stored_height - target_height)
+        else:
+            x = (stored_width - target_width) // 2
+            y = (stored_height - target_height) // 2
+        crop = self.images[index, y:y + target_height, x:x + target_width]
+        return Image.fromarray(np.ascontiguousarray(crop), 'RGB')
+
+
+class TextNotVisibleError(ValueError):
+    """ข้อความไม่มีพิกเซลที่มองเห็นได้หลังการบิดเบือน (เช่นฟอนต์ไม่มี glyph หรือเล็กเกินไป)"""
+
+
+@dataclasses.dataclass(frozen=True)
+class AugmentationParams:
     """
-    สร้างรูปภาพขนาด 400x400 พิกเซล พร้อมพื้นหลัง, ข้อความที่มีการปรับแต่ง (สี, เอียง XY สุ่มทิศทาง, เบลอ, สุ่มขนาด, เอียงแกน Z จำลอง),
-    และเพิ่มอุปสรรคให้กับพื้นหลัง (เบลอ)
+    ช่วงค่าของการสุ่มอุปสรรคแต่ละแบบ (ช่วงเป็น (ต่ำสุด, สูงสุด))
+    """
+    background_blur: tuple = (0.5, 2.0)
+    font_size: tuple = (20, 300)
+    # ขนาดที่สุ่มได้เกินค่านี้จะถูกลดลงทีละ FONT_SIZE_STEP จนไม่เกิน (เผื่อพื้นที่สำหรับการหมุนและการบิดเบือน)
+    max_font_size: int = MAX_FONT_SIZE
+    rotation: tuple = (-15, 15)
+    shear_probability: float = 0.7
+    # ลดช่วงเพื่อลดการขาด
+    shear: tuple = (-0.25, 0.25)
+    z_tilt_probability: float = 0.5
+    z_tilt_scale: tuple = (0.75, 0.98)
+    text_blur: tuple = (0.0, 1.5)
+    # สัดส่วนสูงสุดของภาพที่ข้อความครอบครองได้
+    max_fit: float = 0.75
+
+
+DEFAULT_AUGMENTATION = AugmentationParams()
+
+
+def render_image_with_obstacles(text_line, font_path, background_pool, rng=None, params=None):
+    """
+    เรนเดอร์รูปภาพขนาด 400x400 พิกเซล พร้อมพื้นหลัง, ข้อความที่มีการปรับแต่ง (สี, เอียง XY สุ่มทิศทาง, เบลอ, สุ่มขนาด, เอียงแกน Z จำลอง),
+    และเพิ่มอุปสรรคให้กับพื้นหลัง (เบลอ) โดยไม่บันทึกไฟล์และไม่พิมพ์ข้อความใดๆ
 
     Args:
         text_line (str): ข้อความที่ต้องการเรนเดอร์
         font_path (str): พาธไปยังไฟล์ฟอนต์ .ttf
-        background_image_path (str): พาธไปยังไฟล์รูปภาพพื้นหลัง
-        output_folder (str): โฟลเดอร์สำหรับบันทึกรูปภาพที่สร้างขึ้น
-        image_index (int): ดัชนีสำหรับตั้งชื่อไฟล์รูปภาพเอาต์พุต
+        background_pool (BackgroundPool): คลังภาพพื้นหลังที่โหลดไว้แล้ว
+        rng (random.Random, optional): ตัวสุ่มที่ใช้กับการสุ่มทั้งหมดของภาพนี้ (ค่าเริ่มต้นคือโมดูล random)
+        params (AugmentationParams, optional): ช่วงค่าของการสุ่มอุปสรรค (ค่าเริ่มต้นคือ DEFAULT_AUGMENTATION)
     Returns:
-        tuple: (output_filename_relative, clean_text_line) หากสร้างสำเร็จ, มิฉะนั้น (None, None)
+        PIL.Image.Image: รูปภาพโหมด RGB (ภาพทึบทั้งภาพ จึงไม่มีช่อง alpha)
+    Raises:
+        TextNotVisibleError: ถ้าข้อความไม่มีพิกเซลที่มองเห็นได้หลังการบิดเบือน
     """
-    try:
-        # 1. สร้างรูปภาพ 400x400 px และ 2. พื้นหลัง
-        background = Image.open(background_image_path).convert("RGBA")
-        target_size = (400, 400)
-        background = background.resize(target_size, Image.Resampling.LANCZOS)
-        width, height = background.size
-
-        # 5. เพิ่มอุปสรรค เช่น เบลอรูปพื้นหลัง (Gaussian Blur)
-        background = background.filter(ImageFilter.GaussianBlur(radius=random.uniform(0.5, 2.0))) 
-
-        # 3. ใส่ตัวหนังสือ
-        # ใส่อุปสรรค: สุ่มขนาดตัวหนังสือเริ่มต้น (20 ถึง 300)
-        font_size = random.randint(20, 300) 
-        font = ImageFont.truetype(font_path, font_size)
-
-        # ใส่อุปสรรค: ใส่สีตัวหนังสือ (ทุกสี)
-        text_color = (random.randint(0, 255), random.randint(0, 255), random.randint(0, 255), 255) 
-
-        # คำนวณขนาดข้อความเริ่มต้น (ยังไม่หมุน) เพื่อใช้ในการปรับขนาดฟอนต์
-        temp_draw = ImageDraw.Draw(Image.new('RGBA', (1,1))) 
-        bbox_unrotated = temp_draw.textbbox((0, 0), text_line, font=font)
-        text_width_unrotated = bbox_unrotated[2] - bbox_unrotated[0]
-        text_height_unrotated = bbox_unrotated[3] - bbox_unrotated[1]
-
-        # ปรับขนาดฟอนต์ถ้าข้อความกว้าง/สูงเกินรูปภาพ พร้อมให้มีระยะขอบ
-        max_text_dimension = max(width, height) * 0.95 
-        min_font_size = 5 
-
-        # --- ปรับปรุงลูปการลดขนาดฟอนต์เริ่มต้น ---
-        # ลดขนาดฟอนต์ลงเร็วขึ้นหากฟอนต์เริ่มต้นใหญ่มาก เพื่อให้มีพื้นที่เผื่อการหมุนและการบิดเบือน
-        while ((text_width_unrotated > max_text_dimension or 
-                text_height_unrotated > max_text_dimension) or 
-               font_size > 200) and font_size > min_font_size:
-            font_size -= 5 
-            if font_size < min_font_size:
-                font_size = min_font_size
-            font = ImageFont.truetype(font_path, font_size)
-            bbox_unrotated = temp_draw.textbbox((0, 0), text_line, font=font)
-            text_width_unrotated = bbox_unrotated[2] - bbox_unrotated[0]
-            text_height_unrotated = bbox_unrotated[3] - bbox_unrotated[1]
+    if rng is None:
+        rng = random
+    if params is None:
+        params = DEFAULT_AUGMENTATION
+
+    # 1. สร้างรูปภาพ 400x400 px และ 2. พื้นหลัง (สุ่มจากคลังที่ decode และ resize ไว้แล้ว)
+    background = background_pool.sample(rng)
+    width, height = background.size
+    profiling.lap('background')
+
+    # 5. เพิ่มอุปสรรค เช่น เบลอรูปพื้นหลัง (Gaussian Blur)
+    background = background.filter(ImageFilter.GaussianBlur(radius=rng.uniform(*params.background_blur))) 
+    profiling.lap('background_blur')
+
+    # 3. ใส่ตัวหนังสือ และ 6. วางข้อความลงบนพื้นหลัง (ลงสีด้วยการ paste สีเดียวผ่าน mask)
+    text_color, text_mask, position = render_text_layer(text_line, font_path, (width, height), rng, params)
+    background.paste(text_color, position + (position[0] + text_mask.width, position[1] + text_mask.height), text_mask)
+    profiling.lap('paste')
+
+    return background
+
+
+def render_text_layer(text_line, font_path, image_size, rng, params):
+    """
+    สุ่มอุปสรรคของตัวหนังสือ (ขนาด, สี, เอียง XY, shear, เอียงแกน Z, เบลอ) แล้วสร้าง mask ของข้อความ
+    ที่บิดเบือนและย่อให้พอดีภาพแล้ว โดยยังไม่วางลงบนพื้นหลัง
+
+    Args:
+        text_line (str): ข้อความที่ต้องการเรนเดอร์
+        font_path (str): พาธไปยังไฟล์ฟอนต์ .ttf
+        image_size (tuple): ขนาด (width, height) ของภาพพื้นหลัง
+        rng (random.Random): ตัวสุ่มของภาพนี้
+        params (AugmentationParams): ช่วงค่าของการสุ่มอุปสรรค
+    Returns:
+        tuple: (text_color, mask, position) สี RGB ของตัวหนังสือ, mask โหมด L และตำแหน่งมุมซ้ายบนบนพื้นหลัง
+    Raises:
+        TextNotVisibleError: ถ้าข้อความไม่มีพิกเซลที่มองเห็นได้หลังการบิดเบือน
+    """
+    width, height = image_size
+
+    # 3. ใส่ตัวหนังสือ
+    # ใส่อุปสรรค: สุ่มขนาดตัวหนังสือเริ่มต้น (ค่าเริ่มต้น 20 ถึง 300)
+    font_size = rng.randint(*params.font_size) 
+
+    # ใส่อุปสรรค: ใส่สีตัวหนังสือ (ทุกสี)
+    text_color = (rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255))
+
+    # ปรับขนาดฟอนต์ถ้าข้อความกว้าง/สูงเกินรูปภาพ พร้อมให้มีระยะขอบ
+    max_text_dimension = max(width, height) * 0.95 
+    font, _ = fit_font_size(font_path, text_line, font_size, max_text_dimension, params.max_font_size)
+    profiling.lap('font_fit')
+
+    # ใช้ mask ของตัวหนังสือจาก cache (ข้อความ/ฟอนต์/ขนาดเดียวกันไม่ต้องเรนเดอร์ด้วย FreeType ซ้ำ)
+    text_mask = get_text_mask(text_line, font_path, bucket_font_size(font.size))
+    text_width_unrotated, text_height_unrotated = text_mask.size
+    
+    # --- เตรียม Canvas ขนาดพอดีข้อความ (เผื่อขอบเล็กน้อยให้การ resample ที่ขอบไม่ขาด) ---
+    # ขอบสำหรับการหมุน/shear ไม่ต้องเผื่อ เพราะ warp_with_matrix ขยาย canvas ปลายทางให้พอดีเอง
+    # บิดเบือนเฉพาะ mask (ช่องเดียว) เพราะสีของตัวหนังสือเป็นสีเดียวทั้งหมด จะลงสีตอนวางบนพื้นหลัง
+    canvas_size = (text_width_unrotated + 2 * RESAMPLE_MARGIN, text_height_unrotated + 2 * RESAMPLE_MARGIN)
+    text_image = Image.new('L', canvas_size, 0)
+    text_image.paste(text_mask, (RESAMPLE_MARGIN, RESAMPLE_MARGIN))
+    profiling.lap('text_mask')
+
+    # Canvas อ้างอิงสำหรับการเอียงแกน Z: สี่เหลี่ยมจัตุรัสขนาดทแยงมุมของรูปภาพ 400x400 (+30%) ที่มีข้อความอยู่กึ่งกลาง
+    # ใช้คำนวณรูปสี่เหลี่ยมคางหมูเท่านั้น ไม่ได้สร้างภาพจริง ความแรงของ perspective ต่อข้อความจึงเท่าเดิม
+    diagonal_size = int(math.sqrt(width**2 + height**2) * 1.3)
+    reference_canvas_size = (diagonal_size, diagonal_size)
+    reference_canvas_origin = ((canvas_size[0] - diagonal_size) / 2, (canvas_size[1] - diagonal_size) / 2)
+
+    # ใส่อุปสรรค: เอียงตัวหนังสือ (แกน XY)
+    # ทุกการบิดเบือน (หมุน, shear X/Y, เอียงแกน Z) ถูกรวมเป็น matrix 3x3 เดียว แล้ว resample ภาพครั้งเดียว
+    angle_xy = rng.uniform(*params.rotation) 
+    angle_rad = math.radians(angle_xy)
+    # matrix ของ Image.rotate (หมุนทวนเข็มนาฬิกา) ในทิศทาง source -> destination
+    transform_matrix = _affine_matrix(math.cos(angle_rad), math.sin(angle_rad), 0,
+                                      -math.sin(angle_rad), math.cos(angle_rad), 0)
+    
+    # --- จำลองการเอียงแกน Z โดยการบิดเบือน (Shearing) อย่างถูกต้อง ---
+    apply_shear = rng.random() < params.shear_probability # ค่าเริ่มต้น 70% ที่จะใช้ shear
+    if apply_shear:
+        # สุ่มทิศทางการเอียงทั้งแกน X และ Y (ทั้งบวกและลบ)
+        shear_factor_x = rng.uniform(*params.shear)
+        shear_factor_y = rng.uniform(*params.shear)
+
+        # ShearX: (1, shear_factor_x, 0, 0, 1, 0) คือ matrix ปลายทาง -> ต้นทางแบบเดียวกับ Image.Transform.AFFINE
+        if abs(shear_factor_x) > 0.01: 
+            transform_matrix = np.linalg.inv(_affine_matrix(1, shear_factor_x, 0, 0, 1, 0)) @ transform_matrix
         
-        # --- เตรียม Canvas สำหรับข้อความที่หมุนได้โดยไม่ขาด (รวมถึงการบิดเบือน) ---
-        # ขนาด Canvas ที่ปลอดภัยคือขนาดทแยงมุมของรูปภาพ 400x400
-        # เผื่อพื้นที่เพิ่มขึ้นอีกเล็กน้อยสำหรับ shear transform ที่อาจทำให้ภาพขยายใหญ่ขึ้น
-        diagonal_size = int(math.sqrt(width**2 + height**2) * 1.3) # เพิ่ม 30% เพื่อรองรับ shear/perspective
-        expanded_canvas_size = (diagonal_size, diagonal_size)
-
-        # สร้างรูปภาพโปร่งใสสำหรับข้อความเท่านั้น ด้วยขนาดที่ใหญ่กว่าเดิม
-        text_image = Image.new('RGBA', expanded_canvas_size, (0, 0, 0, 0))
-        text_draw = ImageDraw.Draw(text_image)
-
-        x_text_on_expanded_image = (expanded_canvas_size[0] - text_width_unrotated) / 2
-        y_text_on_expanded_image = (expanded_canvas_size[1] - text_height_unrotated) / 2
+        # ShearY
+        if abs(shear_factor_y) > 0.01:
+            transform_matrix = np.linalg.inv(_affine_matrix(1, 0, 0, shear_factor_y, 1, 0)) @ transform_matrix
+
+        # --- จำลองการเอียงแกน -Z ด้วย perspective transform จริงจากสี่เหลี่ยมคางหมู 4 มุม ---
+        apply_z_tilt = rng.random() < params.z_tilt_probability # ค่าเริ่มต้นโอกาส 50% ที่จะใช้ Z tilt
+        if apply_z_tilt:
+            # สุ่มว่าจะทำให้ด้านบน/ล่างเล็กลง หรือ ซ้าย/ขวาเล็กลง
+            top_or_bottom_tilt = rng.choice(['top_smaller', 'bottom_smaller', 'left_smaller', 'right_smaller'])
+            z_scale_factor = rng.uniform(*params.z_tilt_scale) # ค่าเริ่มต้นย่อขนาด 75-98%
+
+            # ใช้กรอบของ canvas หลังหมุนและ shear เป็นสี่เหลี่ยมตั้งต้นของ perspective
+            tilt_bounds = _transformed_bounds(transform_matrix, reference_canvas_size, reference_canvas_origin)
+            transform_matrix = z_tilt_matrix(tilt_bounds, top_or_bottom_tilt, z_scale_factor) @ transform_matrix
+
+    # ใส่อุปสรรค: เบลอตัวหนังสือ
+    # สุ่มรัศมีก่อน warp เพื่อเผื่อขอบของ canvas ปลายทางให้เบลอกระจายออกได้ไม่ขาด (~3 เท่าของรัศมี)
+    text_blur_radius = rng.uniform(*params.text_blur) 
+    blur_margin = math.ceil(3 * text_blur_radius) + 1 if text_blur_radius > 0 else 0
+    rotated_text_image = warp_with_matrix(text_image, transform_matrix, margin=blur_margin, fillcolor=0)
+    profiling.lap('warp')
+
+    if text_blur_radius > 0:
+        rotated_text_image = rotated_text_image.filter(ImageFilter.GaussianBlur(radius=text_blur_radius))
+    profiling.lap('text_blur')
+
+    # --- ปรับขนาดและวางตำแหน่งบนพื้นหลัง 400x400 ---
+    # หา bounding box ของเนื้อหาหลังจากการ transformation ทั้งหมด
+    rotated_bbox_content = rotated_text_image.getbbox()
+
+    if rotated_bbox_content: 
+        # Crop รูปภาพให้เหลือเฉพาะเนื้อหา
+        cropped_rotated_text_image = rotated_text_image.crop(rotated_bbox_content)
+
+        final_content_width = cropped_rotated_text_image.width
+        final_content_height = cropped_rotated_text_image.height
+
+        # กำหนดขนาดสูงสุดที่ข้อความสามารถครอบครองได้บนภาพพื้นหลัง
+        # ลดค่านี้ลงเพื่อให้มีขอบว่างมากขึ้น ป้องกันการขาด
+        final_max_fit_width = width * params.max_fit 
+        final_max_fit_height = height * params.max_fit
+
+        scale_factor = 1.0
+        if final_content_width > final_max_fit_width:
+            scale_factor = min(scale_factor, final_max_fit_width / final_content_width)
+        if final_content_height > final_max_fit_height:
+            scale_factor = min(scale_factor, final_max_fit_height / final_content_height)
         
-        text_draw.text((x_text_on_expanded_image, y_text_on_expanded_image), text_line, font=font, fill=text_color)
+        if scale_factor < 1.0: # ถ้าต้องย่อขนาด
+            new_content_width = int(final_content_width * scale_factor)
+            new_content_height = int(final_content_height * scale_factor)
+            # ตรวจสอบขนาดขั้นต่ำเพื่อป้องกันข้อผิดพลาด
+            if new_content_width < 1: new_content_width = 1
+            if new_content_height < 1: new_content_height = 1
 
-        # ใส่อุปสรรค: เอียงตัวหนังสือ (แกน XY)
-        angle_xy = random.uniform(-15, 15) 
-        rotated_text_image = text_image.rotate(angle_xy, center=(expanded_canvas_size[0]/2, expanded_canvas_size[1]/2), expand=True, fillcolor=(0,0,0,0))
+            cropped_rotated_text_image = cropped_rotated_text_image.resize((new_content_width, new_content_height), Image.Resampling.LANCZOS)
         
-        # --- จำลองการเอียงแกน Z โดยการบิดเบือน (Shearing) อย่างถูกต้อง ---
-        apply_shear = random.random() < 0.7 # 70% ที่จะใช้ shear
-        if apply_shear:
-            # สุ่มทิศทางการเอียงทั้งแกน X และ Y (ทั้งบวกและลบ)
-            shear_factor_x = random.uniform(-0.25, 0.25) # ลดช่วงเพื่อลดการขาด
-            shear_factor_y = random.uniform(-0.25, 0.25) # ลดช่วงเพื่อลดการขาด
-
-            # Apply ShearX transform matrix
-            if abs(shear_factor_x) > 0.01: 
-                rotated_text_image = rotated_text_image.transform(
-                    rotated_text_image.size,
-                    Image.Transform.AFFINE, # แก้ไข: เปลี่ยนจาก AFFine เป็น AFFINE
-                    (1, shear_factor_x, 0, 0, 1, 0), # (a, b, c, d, e, f)
-                    resample=Image.Resampling.BICUBIC
-                )
-            
-            # Apply ShearY transform matrix
-            if abs(shear_factor_y) > 0.01:
-                 rotated_text_image = rotated_text_image.transform(
-                    rotated_text_image.size,
-                    Image.Transform.AFFINE, # แก้ไข: เปลี่ยนจาก AFFine เป็น AFFINE
-                    (1, 0, 0, shear_factor_y, 1, 0), # (a, b, c, d, e, f)
-                    resample=Image.Resampling.BICUBIC
-                )
-
-            # --- จำลองการเอียงแกน -Z โดยการปรับขนาดความสูง (Perspective Scaling แบบง่าย) ---
-            apply_z_tilt = random.random() < 0.5 # โอกาส 50% ที่จะใช้ Z tilt
-            if apply_z_tilt:
-                current_width = rotated_text_image.width
-                current_height = rotated_text_image.height
-
-                if current_height > 10 and current_width > 10: # ป้องกัน error ถ้าขนาดน้อยเกินไป
-                    # สุ่มว่าจะทำให้ด้านบน/ล่างเล็กลง หรือ ซ้าย/ขวาเล็กลง
-                    top_or_bottom_tilt = random.choice(['top_smaller', 'bottom_smaller', 'left_smaller', 'right_smaller'])
-                    z_scale_factor = random.uniform(0.75, 0.98) # ย่อขนาด 75-98%
-
-                    if top_or_bottom_tilt in ['top_smaller', 'bottom_smaller']:
-                        z_tilted_image = Image.new('RGBA', (current_width, current_height), (0, 0, 0, 0))
-                        
-                        for y in range(current_height):
-                            scale_y = 1.0
-                            if top_or_bottom_tilt == 'top_smaller':
-                                # ด้านบนเล็กลง, ด้านล่างปกติ
-                                scale_y = z_scale_factor + (1.0 - z_scale_factor) * (y / current_height)
-                            else: # bottom_smaller
-                                # ด้านล่างเล็กลง, ด้านบนปกติ
-                                scale_y = 1.0 - (1.0 - z_scale_factor) * (y / current_height)
-                            
-                            new_row_width = int(current_width * scale_y)
-                            if new_row_width > 0: # ตรวจสอบป้องกันขนาดเป็นศูนย์
-                                row_offset_x = (current_width - new_row_width) // 2
-                                
-                                # Crop แถวเดียวและ resize
-                                row_image = rotated_text_image.crop((0, y, current_width, y + 1))
-                                row_image = row_image.resize((new_row_width, 1), Image.Resampling.LANCZOS)
-                                z_tilted_image.paste(row_image, (row_offset_x, y))
-                        rotated_text_image = z_tilted_image
-
-                    elif top_or_bottom_tilt in ['left_smaller', 'right_smaller']:
-                        # วิธีที่ง่ายกว่าคือหมุนภาพ 90 องศา, ทำ row-wise tilt, แล้วหมุนกลับ
-                        temp_col_image = rotated_text_image.transpose(Image.Transpose.ROTATE_90)
-                        temp_col_image_width, temp_col_image_height = temp_col_image.size
-                        
-                        tilted_temp_col_image = Image.new('RGBA', (temp_col_image_width, temp_col_image_height), (0,0,0,0))
-
-                        for y_temp in range(temp_col_image_height): # y_temp ตรงกับ x เดิมของภาพต้นฉบับ
-                            scale_along_y_temp = 1.0
-                            if top_or_bottom_tilt == 'left_smaller': # 'left_smaller' ในภาพต้นฉบับคือ 'top_smaller' หลังหมุน 90
-                                scale_along_y_temp = z_scale_factor + (1.0 - z_scale_factor) * (y_temp / temp_col_image_height)
-                            else: # 'right_smaller' ในภาพต้นฉบับคือ 'bottom_smaller' หลังหมุน 90
-                                scale_along_y_temp = 1.0 - (1.0 - z_scale_factor) * (y_temp / temp_col_image_height)
-                            
-                            new_row_width_temp = int(temp_col_image_width * scale_along_y_temp)
-                            if new_row_width_temp > 0: # ตรวจสอบป้องกันขนาดเป็นศูนย์
-                                row_offset_x_temp = (temp_col_image_width - new_row_width_temp) // 2
-                                row_image_temp = temp_col_image.crop((0, y_temp, temp_col_image_width, y_temp + 1))
-                                row_image_temp = row_image_temp.resize((new_row_width_temp, 1), Image.Resampling.LANCZOS)
-                                tilted_temp_col_image.paste(row_image_temp, (row_offset_x_temp, y_temp))
-                        
-                        rotated_text_image = tilted_temp_col_image.transpose(Image.Transpose.ROTATE_270) # หมุนกลับไปทิศทางเดิม
-                        
-                        # หลังจากการหมุนกลับและบิดเบือน ควร re-evaluate bbox อีกครั้งเพื่อตัดส่วนเกิน
-                        rotated_text_image_bbox = rotated_text_image.getbbox()
-                        if rotated_text_image_bbox:
-                            rotated_text_image = rotated_text_image.crop(rotated_text_image_bbox)
-                        
-                        # Resample ให้กลับมาเป็นขนาดเดิม (เพื่อไม่ให้ภาพใหญ่เกินไปเมื่อนำไปวาง)
-                        # ใช้ขนาด original_width, original_height ที่ได้มาจากก่อน shear/z-tilt
-                        rotated_text_image = rotated_text_image.resize((current_width, current_height), Image.Resampling.LANCZOS)
-
-
-        # ใส่อุปสรรค: เบลอตัวหนังสือ
-        text_blur_radius = random.uniform(0.0, 1.5) 
-        if text_blur_radius > 0:
-            rotated_text_image = rotated_text_image.filter(ImageFilter.GaussianBlur(radius=text_blur_radius))
-
-        # --- ปรับขนาดและวางตำแหน่งบนพื้นหลัง 400x400 ---
-        # หา bounding box ของเนื้อหาหลังจากการ transformation ทั้งหมด
-        rotated_bbox_content = rotated_text_image.getbbox()
-
-        if rotated_bbox_content: 
-            # Crop รูปภาพให้เหลือเฉพาะเนื้อหา
-            cropped_rotated_text_image = rotated_text_image.crop(rotated_bbox_content)
-
-            final_content_width = cropped_rotated_text_image.width
-            final_content_height = cropped_rotated_text_image.height
-
-            # กำหนดขนาดสูงสุดที่ข้อความสามารถครอบครองได้บนภาพพื้นหลัง
-            # ลดค่านี้ลงเพื่อให้มีขอบว่างมากขึ้น ป้องกันการขาด
-            final_max_fit_width = width * 0.75 
-            final_max_fit_height = height * 0.75
-
-            scale_factor = 1.0
-            if final_content_width > final_max_fit_width:
-                scale_factor = min(scale_factor, final_max_fit_width / final_content_width)
-            if final_content_height > final_max_fit_height:
-                scale_factor = min(scale_factor, final_max_fit_height / final_content_height)
-            
-            if scale_factor < 1.0: # ถ้าต้องย่อขนาด
-                new_content_width = int(final_content_width * scale_factor)
-                new_content_height = int(final_content_height * scale_factor)
-                # ตรวจสอบขนาดขั้นต่ำเพื่อป้องกันข้อผิดพลาด
-                if new_content_width < 1: new_content_width = 1
-                if new_content_height < 1: new_content_height = 1
-
-                cropped_rotated_text_image = cropped_rotated_text_image.resize((new_content_width, new_content_height), Image.Resampling.LANCZOS)
-            
-            # อัปเดตขนาดที่ใช้คำนวณตำแหน่ง (หลังจากอาจมีการย่อ)
-            final_content_width = cropped_rotated_text_image.width
-            final_content_height = cropped_rotated_text_image.height
-
-            # คำนวณตำแหน่งที่จะวาง cropped_rotated_text_image บน background 400x400 ให้กึ่งกลาง
-            paste_x = int((width - final_content_width) / 2)
-            paste_y = int((height - final_content_height) / 2)
-
-            # 6. วางข้อความลงบนพื้นหลัง
-            background.paste(cropped_rotated_text_image, (paste_x, paste_y), cropped_rotated_text_image)
-        else:
-            print(f"คำเตือน: ข้อความ '{text_line.strip()}' อาจเล็กเกินไปหรือมองไม่เห็น จึงไม่ได้ถูกวางลงบนรูปภาพ")
+        # อัปเดตขนาดที่ใช้คำนวณตำแหน่ง (หลังจากอาจมีการย่อ)
+        final_content_width = cropped_rotated_text_image.width
+        final_content_height = cropped_rotated_text_image.height
+
+        # คำนวณตำแหน่งที่จะวาง cropped_rotated_text_image บน background 400x400 ให้กึ่งกลาง
+        paste_x = int((width - final_content_width) / 2)
+        paste_y = int((height - final_content_height) / 2)
+        profiling.lap('fit')
+    else:
+        raise TextNotVisibleError(f"คำเตือน: ข้อความ '{text_line.strip()}' อาจเล็กเกินไปหรือมองไม่เห็น จึงไม่ได้ถูกวางลงบนรูปภาพ")
+
+    return text_color, cropped_rotated_text_image, (paste_x, paste_y)
+
+
+def make_sample_name(text_line, image_index):
+    """
+    ตั้งชื่อภาพจากตัวหนังสือ (ตัดอักขระที่ไม่ใช่ตัวอักษร/ตัวเลขออก) ต่อท้ายด้วยดัชนีเพื่อไม่ให้ชื่อซ้ำกัน
+
+    Args:
+        text_line (str): ข้อความของภาพ
+        image_index (int): ดัชนีของภาพ
+    Returns:
+        str: ชื่อภาพ (ยังไม่รวมนามสกุลไฟล์)
+    """
+    clean_text_for_filename = "".join(c for c in text_line if c.isalnum() or c in (' ', '_')).strip()
+    clean_text_for_filename = clean_text_for_filename.replace(" ", "_")
+    if not clean_text_for_filename: 
+        clean_text_for_filename = f"image_{image_index}"
+
+    # จำกัดความยาวชื่อไฟล์เพื่อหลีกเลี่ยงชื่อที่ยาวเกินไป
+    max_filename_len = 50
+    if len(clean_text_for_filename) > max_filename_len:
+        clean_text_for_filename = clean_text_for_filename[:max_filename_len] + f"_{image_index}"
+    else:
+        clean_text_for_filename = f"{clean_text_for_filename}_{image_index}"
+    return f"{clean_text_for_filename}_BG"
+
+
+def generate_image_with_obstacles(text_line, font_path, background_pool, output_folder, image_index, rng=None):
+    """
+    สร้างรูปภาพด้วย render_image_with_obstacles แล้วบันทึกเป็นไฟล์ PNG ลงใน output_folder
+
+    Args:
+        text_line (str): ข้อความที่ต้องการเรนเดอร์
+        font_path (str): พาธไปยังไฟล์ฟอนต์ .ttf
+        background_pool (BackgroundPool): คลังภาพพื้นหลังที่โหลดไว้แล้ว
+        output_folder (str): โฟลเดอร์สำหรับบันทึกรูปภาพที่สร้างขึ้น
+        image_index (int): ดัชนีสำหรับตั้งชื่อไฟล์รูปภาพเอาต์พุต
+        rng (random.Random, optional): ตัวสุ่มที่ใช้กับการสุ่มทั้งหมดของภาพนี้ (ค่าเริ่มต้นคือโมดูล random)
+    Returns:
+        tuple: (output_filename_relative, clean_text_line) หากสร้างสำเร็จ, มิฉะนั้น (None, None)
+    """
+    try:
+        background = render_image_with_obstacles(text_line, font_path, background_pool, rng)
 
         # สร้างโฟลเดอร์เอาต์พุตหากยังไม่มี
         os.makedirs(output_folder, exist_ok=True)
 
         # ตั้งชื่อไฟล์ให้เป็น ตัวหนังสือ_BG.png
-        clean_text_for_filename = "".join(c for c in text_line if c.isalnum() or c in (' ', '_')).strip()
-        clean_text_for_filename = clean_text_for_filename.replace(" ", "_")
-        if not clean_text_for_filename: 
-            clean_text_for_filename = f"image_{image_index}"
-
-        # จำกัดความยาวชื่อไฟล์เพื่อหลีกเลี่ยงชื่อที่ยาวเกินไป
-        max_filename_len = 50
-        if len(clean_text_for_filename) > max_filename_len:
-            clean_text_for_filename = clean_text_for_filename[:max_filename_len] + f"_{image_index}"
-        else:
-            clean_text_for_filename = f"{clean_text_for_filename}_{image_index}"
-
-        output_filename = os.path.join(output_folder, f"{clean_text_for_filename}_BG.png")
+        output_filename = os.path.join(output_folder, f"{make_sample_name(text_line, image_index)}.png")
         background.save(output_filename)
         print(f"สร้างแล้ว: {output_filename} สำหรับข้อความ: '{text_line.strip()}'")
 
         return os.path.join("images", os.path.basename(output_filename)), text_line.strip()
 
+    except TextNotVisibleError as e:
+        print(e)
     except FileNotFoundError as e:
         print(f"ข้อผิดพลาด: ไม่พบไฟล์ - {e}")
     except Exception as e:
         print(f"เกิดข้อผิดพลาด: {e}")
     return None, None
 
+
+def generate_sample(text_line, font_path, background_pool, rng, params=None, as_array=False):
+    """
+    สร้างภาพตัวอย่างหนึ่งภาพในหน่วยความจำสำหรับใช้ใน dataloader ระหว่างเทรน (ไม่มี I/O และไม่พิมพ์ข้อความ)
+
+    Args:
+        text_line (str): ข้อความที่ต้องการเรนเดอร์
+        font_path (str): พาธไปยังไฟล์ฟอนต์ .ttf
+        background_pool (BackgroundPool): คลังภาพพื้นหลังที่โหลดไว้แล้ว
+        rng (random.Random | numpy.random.Generator): ตัวสุ่มของภาพนี้
+        params (AugmentationParams, optional): ช่วงค่าของการสุ่มอุปสรรค
+        as_array (bool): คืนภาพเป็น numpy array uint8 (H, W, 3) แทน PIL.Image
+    Returns:
+        tuple: (image, label)
+    Raises:
+        TextNotVisibleError: ถ้าข้อความไม่มีพิกเซลที่มองเห็นได้หลังการบิดเบือน
+    """
+    if isinstance(rng, np.random.Generator):
+        # โค้ดเรนเดอร์ใช้ API ของ random.Random จึงสร้างตัวสุ่มใหม่จาก state ของ Generator
+        rng = random.Random(int(rng.integers(2**63)))
+    image = render_image_with_obstacles(text_line, font_path, background_pool, rng, params)
+    if as_array:
+        image = np.asarray(image.convert("RGB"))
+    return image, text_line.strip()
+
+
+class ThaiTextImageDataset(IterableDataset):
+    """
+    ชุดข้อมูลแบบไม่จำกัดจำนวนที่สร้างภาพจากรายการคำแบบ on-the-fly
+    ถ้าติดตั้ง PyTorch จะเป็น torch.utils.data.IterableDataset จึงส่งให้ DataLoader ได้โดยตรง
+    (ไม่มี __len__ เพราะไม่จำกัดจำนวน ให้จำกัดจำนวน batch ที่ฝั่ง training loop)
+
+    ภาพที่ดัชนี index สร้างจากตัวสุ่มของ (seed, index) เสมอ จึงได้ภาพเดิมทุกครั้ง (เรียก dataset[index] ได้)
+    ส่วนการวนลูป (iter) ใน DataLoader หลาย worker จะแบ่งดัชนีกันตาม worker id โดยไม่ซ้ำกัน
+    """
+
+    def __init__(self, words, font_path, background_pool, seed=0, params=None, as_array=False, transform=None):
+        """
+        Args:
+            words (list[str]): รายการคำที่ใช้สุ่ม
+            font_path (str): พาธไปยังไฟล์ฟอนต์ .ttf
+            background_pool (BackgroundPool): คลังภาพพื้นหลัง
+            seed (int): seed หลัก
+            params (AugmentationParams, optional): ช่วงค่าของการสุ่มอุปสรรค
+            as_array (bool): คืนภาพเป็น numpy array แทน PIL.Image
+            transform (callable, optional): ฟังก์ชันที่เรียกกับภาพก่อนคืนค่า
+        """
+        self.words = [word.strip() for word in words if word.strip()]
+        if not self.words:
+            raise ValueError("รายการคำว่างเปล่า")
+        self.font_path = font_path
+        self.background_pool = background_pool
+        self.seed = seed
+        self.params = params
+        self.as_array = as_array
+        self.transform = transform
+
+    def __getitem__(self, index):
+        """
+        Raises:
+            TextNotVisibleError: ถ้าสุ่มคำครบ MAX_SAMPLE_ATTEMPTS ครั้งแล้วยังมองไม่เห็นข้อความเลย
+                (เช่นฟอนต์ไม่มี glyph ของคำในรายการ)
+        """
+        rng = make_sample_rng(self.seed, index)
+        # ถ้าคำนี้มองไม่เห็นหลังบิดเบือน ให้สุ่มใหม่ด้วยตัวสุ่มเดิม (ยังได้ผลเหมือนเดิมทุกครั้ง)
+        for _ in range(MAX_SAMPLE_ATTEMPTS):
+            word = rng.choice(self.words)
+            try:
+                image, label = generate_sample(word, self.font_path, self.background_pool, rng,
+                                               self.params, self.as_array)
+                break
+            except TextNotVisibleError:
+                pass
+        else:
+            raise TextNotVisibleError(f"สร้างภาพที่ดัชนี {index} ไม่สำเร็จ: ข้อความมองไม่เห็นทั้ง {MAX_SAMPLE_ATTEMPTS} ครั้ง "
+                                      f"(ตรวจสอบว่าฟอนต์ '{self.font_path}' แสดงคำในรายการได้)")
+        if self.transform is not None:
+            image = self.transform(image)
+        return image, label
+
+    def __iter__(self):
+        start, step = 0, 1
+        worker_info = get_worker_info() if get_worker_info is not None else None
+        if worker_info is not None:
+            start, step = worker_info.id, worker_info.num_workers
+        for index in itertools.count(start, step):
+            yield self[index]
+
+
 # --- Configuration ---
 TEXT_FILE = "thai_dict_clean.txt"
 FONT_PATH = "Sarun's ThangLuang.ttf" 
-BACKGROUND_IMAGE_PATH = "BG/bg_1.jpg" 
+BACKGROUND_DIR = "BG" 
 OUTPUT_FOLDER = "images" 
+LABELS_FOLDER = "labels"
+CHECKPOINT_FILENAME = ".checkpoint.json"
+SPLIT_RATIOS = (("train", 0.70), ("val", 0.20), ("test", 0.10))
+DEFAULT_CHECKPOINT_EVERY = 100
+OUTPUT_FORMATS = ('folder', 'tar', 'lmdb')
+DEFAULT_OUTPUT_PATHS = {'folder': OUTPUT_FOLDER, 'tar': "shards", 'lmdb': "dataset.lmdb"}
+DEFAULT_ENCODING = ('png', DEFAULT_QUALITY, DEFAULT_PNG_COMPRESS_LEVEL)
+DEFAULT_WORKERS = os.cpu_count() or 1
+DEFAULT_CHUNKSIZE = 16
+
+# สถานะของแต่ละ worker process ที่ตั้งค่าครั้งเดียวตอนเริ่ม (เช่นคลังภาพพื้นหลัง)
+_worker_state = {}
+
+
+def make_sample_rng(seed, image_index):
+    """
+    สร้างตัวสุ่มเฉพาะของแต่ละภาพจาก seed หลัก เพื่อให้ผลลัพธ์เหมือนเดิมไม่ว่าจะใช้กี่ worker
+    หรือ worker ไหนเป็นคนสร้างภาพนั้น
+
+    Args:
+        seed (int): seed หลักของการรันทั้งหมด
+        image_index (int): ดัชนีของภาพ
+    Returns:
+        random.Random: ตัวสุ่มของภาพนี้
+    """
+    return random.Random(f"{seed}:{image_index}")
+
+
+def _init_worker(background_pool, mask_cache_bytes=TEXT_MASK_CACHE_BYTES, profile=False, font_metrics=None):
+    """
+    ตั้งค่า worker ครั้งเดียวตอนเริ่ม process เพื่อไม่ต้องส่งคลังภาพพื้นหลังและตารางฟอนต์ไปพร้อมกับทุกงาน
+    """
+    _worker_state['background_pool'] = background_pool
+    _worker_state['profile'] = profile
+    set_font_metrics(font_metrics)
+    if _text_mask_cache.max_bytes != mask_cache_bytes:
+        set_text_mask_cache_size(mask_cache_bytes)
+
+
+def _generate_task(task):
+    """
+    ฟังก์ชันที่ worker แต่ละตัวใน process pool เรียกใช้ (ต้องอยู่ระดับโมดูลเพื่อให้ pickle ได้)
+
+    Args:
+        task (tuple): (image_index, text_line, font_path, seed, encoding, params)
+            โดย encoding คือ (image_format, quality, compress_level) สำหรับ encode_image
+            และ params คือ AugmentationParams ของภาพนี้ (None = DEFAULT_AUGMENTATION)
+    Returns:
+        tuple: (image_index, name, data, extension, text, timings) โดย name/data/extension/text เป็น None
+            ถ้าสร้างไม่สำเร็จ และ timings เป็น None ถ้าไม่ได้เปิดการจับเวลา
+    """
+    image_index, text_line, font_path, seed, encoding, params = task
+    rng = make_sample_rng(seed, image_index)
+    if _worker_state.get('profile'):
+        profiling.start_sample_timing()
+    try:
+        image = render_image_with_obstacles(text_line, font_path, _worker_state['background_pool'], rng, params)
+        # เข้ารหัสภาพใน worker เพื่อให้ process หลักทำแค่เขียนข้อมูลลง writer
+        data, extension = encode_image(image, *encoding)
+        profiling.lap('encode')
+    except TextNotVisibleError as e:
+        print(e)
+    except FileNotFoundError as e:
+        print(f"ข้อผิดพลาด: ไม่พบไฟล์ - {e}")
+    except Exception as e:
+        print(f"เกิดข้อผิดพลาด: {e}")
+    else:
+        timings = profiling.finish_sample_timing()
+        return image_index, make_sample_name(text_line, image_index), data, extension, text_line, timings
+    profiling.finish_sample_timing()
+    return image_index, None, None, None, None, None
+
+
+def iter_tasks(lines, font_path, seed, encoding=DEFAULT_ENCODING, start_index=0, params=None):
+    """
+    สร้างงานทีละบรรทัดแบบ lazy (ไม่ต้องอ่านไฟล์ทั้งหมดเข้าหน่วยความจำ)
+
+    Args:
+        lines (iterable[str]): บรรทัดข้อความ เช่น file object ที่เปิดไว้
+        font_path (str): พาธไปยังไฟล์ฟอนต์ .ttf
+        seed (int): seed หลัก
+        encoding (tuple): (image_format, quality, compress_level) สำหรับ encode_image
+        start_index (int): ข้ามบรรทัดที่มีดัชนีไม่เกินค่านี้ (ใช้ตอน resume)
+        params (AugmentationParams, optional): ช่วงค่าของการสุ่มอุปสรรคของทุกภาพ
+    Yields:
+        tuple: งานสำหรับ _generate_task
+    """
+    for i, line in enumerate(lines):
+        image_index = i + 1
+        clean_line = line.strip()
+        if image_index > start_index and clean_line:
+            yield (image_index, clean_line, font_path, seed, encoding, params)
+
+
+def iter_file_tasks(text_file, font_path, seed, encoding=DEFAULT_ENCODING, start_index=0):
+    """เหมือน iter_tasks แต่เปิดและอ่าน text_file ทีละบรรทัดเอง (ปิดไฟล์เมื่ออ่านครบ)"""
+    with open(text_file, 'r', encoding='utf-8') as f:
+        yield from iter_tasks(f, font_path, seed, encoding, start_index)
+
+
+def generate_stream(tasks, background_pool, workers=1, chunksize=DEFAULT_CHUNKSIZE,
+                    mask_cache_bytes=TEXT_MASK_CACHE_BYTES, profile=False, font_metrics=None):
+    """
+    สร้างรูปภาพจากงานที่ส่งเข้ามาแบบ generator และคืนผลลัพธ์ตามลำดับงานทีละรายการ
+
+    งานถูกดึงจาก tasks ทีละช่วง (window) เพื่อไม่ให้ process pool ดึงงานทั้งหมดเข้าคิวล่วงหน้า
+
+    Args:
+        tasks (iterable): งานจาก iter_tasks
+        background_pool (BackgroundPool): คลังภาพพื้นหลัง
+        workers (int): จำนวน process ที่ใช้ (1 = ทำงานใน process เดียว)
+        chunksize (int): จำนวนงานที่ส่งให้ worker ต่อครั้ง
+        mask_cache_bytes (int): ขนาดสูงสุดของ cache mask ตัวหนังสือต่อ process
+        profile (bool): จับเวลาแต่ละขั้นตอนของทุกภาพ
+        font_metrics (dict, optional): font_path -> font_metrics.FontMetrics สำหรับ fit_font_size
+    Yields:
+        tuple: (image_index, name, data, extension, text, timings) เรียงตามลำดับงาน
+    """
+    worker_args = (background_pool, mask_cache_bytes, profile, font_metrics)
+    if workers <= 1:
+        _init_worker(*worker_args)
+        yield from map(_generate_task, tasks)
+        return
+
+    # จำกัดจำนวนงานที่ค้างอยู่ใน pool ไว้ไม่เกิน window งาน: ทุกผลลัพธ์ที่ถูกนำไปใช้จะคืนที่ให้งานใหม่หนึ่งงาน
+    # งานจึงถูกเติมต่อเนื่องใน imap เดียว โดยไม่ต้องรอให้ worker ทำงานทั้งช่วงเสร็จก่อน
+    window = workers * chunksize * 4
+    slots = threading.Semaphore(window)
+    stopped = threading.Event()
+
+    def gated_tasks():
+        # ถูกเรียกจาก thread ส่งงานของ pool
+        for task in tasks:
+            slots.acquire()
+            if stopped.is_set():
+                return
+            yield task
+
+    with multiprocessing.Pool(processes=workers, initializer=_init_worker, initargs=worker_args) as pool:
+        try:
+            # imap คืนผลลัพธ์ตามลำดับงานที่ส่งเข้าไป จึงไม่ขึ้นกับว่า worker ไหนเสร็จก่อน
+            for result in pool.imap(_generate_task, gated_tasks(), chunksize=chunksize):
+                slots.release()
+                yield result
+        finally:
+            # ปลด thread ส่งงานที่อาจรอที่ว่างอยู่ ไม่เช่นนั้นการปิด pool จะค้าง
+            stopped.set()
+            slots.release()
+
+
+def write_samples(results, writer, profiler=None, verbose=True):
+    """
+    เขียนผลลัพธ์จาก generate_stream ลง writer ตามลำดับ
+
+    Args:
+        results (iterable): ผลลัพธ์จาก generate_stream
+        writer: writer จาก dataset_writers.create_writer
+        profiler (profiling.StageProfiler, optional): ตัวรวมเวลาแต่ละขั้นตอน
+        verbose (bool): พิมพ์ชื่อไฟล์ของทุกภาพที่เขียนแล้ว
+    Yields:
+        tuple: (image_index, reference, text) โดย reference/text เป็น None ถ้าสร้างไม่สำเร็จ
+    """
+    for image_index, name, data, extension, text, timings in results:
+        if data is None:
+            yield image_index, None, None
+            continue
+        write_started = time.perf_counter()
+        reference = writer.write(name, data, extension, text)
+        if profiler is not None:
+            timings['write'] = time.perf_counter() - write_started
+            profiler.add(timings)
+        if verbose:
+            print(f"สร้างแล้ว: {reference} สำหรับข้อความ: '{text}'")
+        yield image_index, reference, text
+
+
+def generate_all(lines, font_path, background_pool, writer, seed, workers=1, chunksize=DEFAULT_CHUNKSIZE,
+                 encoding=DEFAULT_ENCODING, mask_cache_bytes=TEXT_MASK_CACHE_BYTES, profiler=None, verbose=True):
+    """
+    สร้างรูปภาพจากทุกบรรทัด โดยกระจายงานไปยัง process pool ได้ ผลลัพธ์จะเรียงตามลำดับบรรทัดเสมอ
+
+    Args:
+        lines (list[str]): บรรทัดข้อความจากไฟล์
+        font_path (str): พาธไปยังไฟล์ฟอนต์ .ttf
+        background_pool (BackgroundPool): คลังภาพพื้นหลัง
+        writer: writer สำหรับบันทึกภาพ (จาก dataset_writers.create_writer)
+        seed (int): seed หลักสำหรับสร้างตัวสุ่มของแต่ละภาพ
+        workers (int): จำนวน process ที่ใช้ (1 = ทำงานใน process เดียว)
+        chunksize (int): จำนวนงานที่ส่งให้ worker ต่อครั้ง
+        encoding (tuple): (image_format, quality, compress_level) สำหรับ encode_image
+        mask_cache_bytes (int): ขนาดสูงสุดของ cache mask ตัวหนังสือต่อ process
+        profiler (profiling.StageProfiler, optional): ถ้าระบุจะจับเวลาแต่ละขั้นตอนของทุกภาพ
+        verbose (bool): พิมพ์ชื่อไฟล์ของทุกภาพที่สร้างแล้ว (ปิดตอนวัดความเร็ว)
+    Returns:
+        list: รายการ (reference, text) ของภาพที่สร้างสำเร็จ เรียงตามลำดับบรรทัด
+    """
+    tasks = iter_tasks(lines, font_path, seed, encoding)
+    results = generate_stream(tasks, background_pool, workers=workers, chunksize=chunksize,
+                              mask_cache_bytes=mask_cache_bytes, profile=profiler is not None)
+    return [(path, text) for _, path, text in write_samples(results, writer, profiler, verbose) if path and text]
+
+
+def split_dataset(generated_data, seed):
+    """
+    สุ่มลำดับข้อมูลด้วย seed แล้วแบ่งเป็น train/val/test (70/20/10)
+
+    Args:
+        generated_data (list): รายการ (relative_path, text)
+        seed (int): seed สำหรับการสุ่มลำดับ
+    Returns:
+        tuple: (train_data, val_data, test_data)
+    """
+    generated_data = list(generated_data)
+    random.Random(seed).shuffle(generated_data)
+
+    total_samples = len(generated_data)
+    train_count = math.ceil(total_samples * 0.70) 
+    val_count = math.ceil(total_samples * 0.20)
+    test_count = total_samples - train_count - val_count
+    
+    if test_count < 0:
+        test_count = 0
+        if train_count + val_count > total_samples:
+            val_count = total_samples - train_count
+            if val_count < 0:
+                val_count = 0
+                train_count = total_samples 
+
+    train_data = generated_data[:train_count]
+    val_data = generated_data[train_count : train_count + val_count]
+    test_data = generated_data[train_count + val_count :] 
+    return train_data, val_data, test_data
+
+
+def write_labels(labels_folder, split_name, data):
+    """
+    เขียนไฟล์ label ในรูปแบบ path<TAB>text ทีละบรรทัด
+    """
+    os.makedirs(labels_folder, exist_ok=True)
+    with open(os.path.join(labels_folder, f"{split_name}.txt"), 'w', encoding='utf-8') as f:
+        for path, text in data:
+            f.write(f"{path}\t{text}\n")
+    print(f"สร้างไฟล์ '{split_name}.txt' แล้ว ({len(data)} รายการ)")
+
+
+def background_source_signature(bg_dir, crop_scale=1.0, target_size=BACKGROUND_SIZE):
+    """
+    ข้อมูลต้นทางของคลังพื้นหลัง (โฟลเดอร์, ไฟล์พร้อมขนาด/mtime, crop_scale, ขนาดภาพ)
+    ใช้ตรวจว่าไฟล์ cache .npy ยังสร้างจากต้นทางเดียวกันหรือไม่
+
+    Returns:
+        dict: ข้อมูลที่บันทึกเป็น JSON ได้
+    """
+    files = []
+    for path in BackgroundPool.list_files(bg_dir):
+        stat = os.stat(path)
+        files.append([path, stat.st_size, int(stat.st_mtime)])
+    return {
+        'directories': [bg_dir] if isinstance(bg_dir, str) else list(bg_dir),
+        'crop_scale': crop_scale,
+        'target_size': list(target_size),
+        'files': files,
+    }
+
+
+def load_background_pool(bg_dir, crop_scale=1.0, cache_path=None):
+    """
+    โหลดคลังภาพพื้นหลัง ถ้าระบุ cache_path จะสร้างไฟล์ .npy ครั้งแรกแล้ว memory-map ในรอบถัดไป
+    ข้อมูลต้นทางถูกเก็บไว้ที่ <cache_path>.json ถ้าโฟลเดอร์, ไฟล์ภาพ หรือ crop_scale เปลี่ยนไปจะสร้าง cache ใหม่
+
+    Args:
+        bg_dir (str | list[str]): โฟลเดอร์ภาพพื้นหลัง (หรือรายการโฟลเดอร์)
+        crop_scale (float): ขนาดที่เก็บเทียบกับขนาดภาพ (มากกว่า 1 เพื่อสุ่ม crop)
+        cache_path (str, optional): พาธไฟล์ cache .npy
+    Returns:
+        BackgroundPool: คลังภาพพื้นหลัง
+    """
+    if cache_path is None:
+        return BackgroundPool.from_directory(bg_dir, crop_scale=crop_scale)
+
+    signature_path = cache_path + ".json"
+    signature = background_source_signature(bg_dir, crop_scale)
+    if os.path.exists(cache_path) and os.path.exists(signature_path):
+        with open(signature_path, 'r', encoding='utf-8') as f:
+            if json.load(f) == signature:
+                return BackgroundPool.load(cache_path)
+        print(f"ภาพพื้นหลังหรือ --bg-crop-scale เปลี่ยนไป: สร้าง cache '{cache_path}' ใหม่")
+
+    BackgroundPool.from_directory(bg_dir, crop_scale=crop_scale).save(cache_path)
+    with open(signature_path, 'w', encoding='utf-8') as f:
+        json.dump(signature, f, ensure_ascii=False)
+    return BackgroundPool.load(cache_path)
+
+
+def split_for_index(seed, image_index, ratios=SPLIT_RATIOS):
+    """
+    เลือก split ของภาพจาก hash ของ (seed, image_index) ทำให้ตัดสินได้ทีละภาพโดยไม่ต้องรู้จำนวนทั้งหมด
+    และได้ผลเหมือนเดิมทุกครั้งที่รันด้วย seed เดียวกัน
+
+    Args:
+        seed (int): seed หลัก
+        image_index (int): ดัชนีของภาพ
+        ratios (tuple): ลำดับของ (ชื่อ split, สัดส่วน)
+    Returns:
+        str: ชื่อ split เช่น 'train'
+    """
+    digest = hashlib.sha256(f"{seed}:{image_index}".encode()).digest()
+    fraction = int.from_bytes(digest[:8], 'big') / 2**64
+    cumulative = 0.0
+    for split_name, ratio in ratios:
+        cumulative += ratio
+        if fraction < cumulative:
+            return split_name
+    return ratios[-1][0]
+
+
+class StreamingLabelWriter:
+    """
+    เขียนไฟล์ label ของแต่ละ split ต่อท้ายทีละบรรทัดระหว่างสร้างภาพ และบันทึก checkpoint
+    (ดัชนีล่าสุดที่เสร็จ + ขนาดไฟล์ label ณ ตอนนั้น) เพื่อให้รันต่อจากจุดเดิมได้หลังโปรแกรมหยุดกลางคัน
+
+    ตอน resume ไฟล์ label จะถูกตัดกลับไปที่ขนาดใน checkpoint ก่อน จึงไม่มีบรรทัดซ้ำ
+    จากภาพที่เขียน label ไปแล้วแต่ยังไม่ทันบันทึก checkpoint
+    """
+
+    def __init__(self, labels_folder, seed, resume=False, split_names=None):
+        """
+        Args:
+            labels_folder (str): โฟลเดอร์สำหรับไฟล์ label และ checkpoint
+            seed (int): seed หลัก (ต้องตรงกับใน checkpoint เมื่อ resume)
+            resume (bool): รันต่อจาก checkpoint เดิม (ถ้ามี)
+            split_names (list[str], optional): ชื่อ split ทั้งหมด
+        """
+        self.labels_folder = labels_folder
+        self.checkpoint_path = os.path.join(labels_folder, CHECKPOINT_FILENAME)
+        self.seed = seed
+        self.last_index = 0
+        self.writer_state = None
+        split_names = split_names or [name for name, _ in SPLIT_RATIOS]
+        os.makedirs(labels_folder, exist_ok=True)
+
+        offsets = {}
+        checkpoint = self.read_checkpoint(labels_folder) if resume else None
+        if checkpoint is not None:
+            if checkpoint['seed'] != seed:
+                raise ValueError(f"seed ({seed}) ไม่ตรงกับ checkpoint ({checkpoint['seed']})")
+            self.last_index = checkpoint['last_index']
+            self.writer_state = checkpoint.get('writer_state')
+            offsets = checkpoint['offsets']
+
+        if checkpoint is not None:
+            # checkpoint ที่ไม่ตรงกับไฟล์ label (เช่นไฟล์ถูกแก้หรือถูกสร้างใหม่) จะทำให้ truncate เติม byte ว่างลงไฟล์
+            for split_name, offset in offsets.items():
+                path = os.path.join(labels_folder, f"{split_name}.txt")
+                size = os.path.getsize(path) if os.path.exists(path) else 0
+                if offset > size:
+                    raise ValueError(f"checkpoint ไม่ตรงกับไฟล์ label: '{path}' มี {size} byte "
+                                     f"แต่ checkpoint ระบุ {offset} byte")
+
+        self.files = {}
+        for split_name in split_names:
+            path = os.path.join(labels_folder, f"{split_name}.txt")
+            if checkpoint is not None and os.path.exists(path):
+                f = open(path, 'r+b')
+                f.truncate(offsets.get(split_name, 0))
+                f.seek(0, os.SEEK_END)
+            else:
+                f = open(path, 'wb')
+            self.files[split_name] = f
+        self.counts = {split_name: 0 for split_name in split_names}
+        if checkpoint is None:
+            # แทนที่ checkpoint ของรอบก่อนทันที (ไฟล์ label ถูกล้างแล้ว) เพื่อไม่ให้ --resume อ่าน checkpoint เก่า
+            self.checkpoint(0)
+
+    @staticmethod
+    def read_checkpoint(labels_folder):
+        """อ่าน checkpoint ในโฟลเดอร์ label (คืน None ถ้าไม่มี)"""
+        checkpoint_path = os.path.join(labels_folder, CHECKPOINT_FILENAME)
+        if not os.path.exists(checkpoint_path):
+            return None
+        with open(checkpoint_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def write(self, split_name, path, text):
+        self.files[split_name].write(f"{path}\t{text}\n".encode('utf-8'))
+        self.counts[split_name] += 1
+
+    def checkpoint(self, last_index, writer_state=None):
+        """
+        flush ไฟล์ label ลงดิสก์ แล้วบันทึก checkpoint แบบ atomic
+
+        Args:
+            last_index (int): ดัชนีล่าสุดที่เสร็จแล้ว
+            writer_state (dict, optional): สถานะจาก writer.flush() สำหรับให้ writer รันต่อได้
+        """
+        offsets = {}
+        for split_name, f in self.files.items():
+            f.flush()
+            os.fsync(f.fileno())
+            offsets[split_name] = f.tell()
+        self.last_index = last_index
+        self.writer_state = writer_state
+
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'seed': self.seed, 'last_index': last_index, 'offsets': offsets,
+                       'writer_state': writer_state}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+
+
+def run_streaming(make_tasks, background_pool, output_format, output_path, labels_folder, seed,
+                  workers=1, chunksize=DEFAULT_CHUNKSIZE, resume=False,
+                  checkpoint_every=DEFAULT_CHECKPOINT_EVERY, shard_size=DEFAULT_SHARD_SIZE,
+                  mask_cache_bytes=TEXT_MASK_CACHE_BYTES, profiler=None, font_metrics=None):
+    """
+    สร้างชุดข้อมูลแบบ streaming: รับงานทีละรายการ, ตัดสิน split ทีละภาพ,
+    เขียน label ต่อท้ายทันที และบันทึก checkpoint ทุก checkpoint_every ภาพ
+
+    Args:
+        make_tasks (callable): make_tasks(start_index) คืนงานที่มีดัชนีมากกว่า start_index ตามลำดับดัชนี
+            เช่น functools.partial(iter_file_tasks, text_file, font_path, seed, encoding)
+            หรืองานจาก job config ที่มีหลายฟอนต์
+        background_pool (BackgroundPool): คลังภาพพื้นหลัง
+        output_format (str): 'folder', 'tar' หรือ 'lmdb'
+        output_path (str): โฟลเดอร์/ฐานข้อมูลปลายทางของภาพ
+        labels_folder (str): โฟลเดอร์สำหรับไฟล์ label และ checkpoint
+        seed (int): seed หลัก
+        workers (int): จำนวน process ที่ใช้
+        chunksize (int): จำนวนงานที่ส่งให้ worker ต่อครั้ง
+        resume (bool): รันต่อจาก checkpoint เดิม
+        checkpoint_every (int): บันทึก checkpoint ทุกกี่ภาพ
+        shard_size (int): จำนวนภาพต่อ shard (เฉพาะ output_format 'tar')
+        mask_cache_bytes (int): ขนาดสูงสุดของ cache mask ตัวหนังสือต่อ process
+        profiler (profiling.StageProfiler, optional): ถ้าระบุจะจับเวลาแต่ละขั้นตอนของทุกภาพ
+        font_metrics (dict, optional): font_path -> font_metrics.FontMetrics สำหรับ fit_font_size
+    Returns:
+        dict: จำนวนรายการที่เขียนในแต่ละ split ระหว่างการรันครั้งนี้
+    """
+    # ตรวจก่อนสร้าง StreamingLabelWriter ซึ่งล้างไฟล์ label และ checkpoint ของรอบก่อน
+    if checkpoint_every < 1:
+        raise ValueError(f"checkpoint_every ต้องเป็นจำนวนเต็มตั้งแต่ 1 ขึ้นไป: {checkpoint_every}")
+    label_writer = StreamingLabelWriter(labels_folder, seed, resume=resume)
+    if label_writer.last_index:
+        print(f"รันต่อจาก checkpoint: ข้ามถึงบรรทัดที่ {label_writer.last_index}")
+    writer = create_writer(output_format, output_path, shard_size=shard_size,
+                           resume_state=label_writer.writer_state)
+
+    last_index = label_writer.last_index
+    tasks = make_tasks(label_writer.last_index)
+    try:
+        results = generate_stream(tasks, background_pool, workers=workers, chunksize=chunksize,
+                                  mask_cache_bytes=mask_cache_bytes, profile=profiler is not None,
+                                  font_metrics=font_metrics)
+        for done, (image_index, path, text) in enumerate(write_samples(results, writer, profiler), start=1):
+            if path and text:
+                label_writer.write(split_for_index(seed, image_index), path, text)
+            last_index = image_index
+            if done % checkpoint_every == 0:
+                # flush ตัวเก็บภาพก่อน label เพื่อให้ทุกบรรทัดใน checkpoint ชี้ไปยังภาพที่อยู่บนดิสก์แล้ว
+                label_writer.checkpoint(last_index, writer.flush())
+        label_writer.checkpoint(last_index, writer.flush())
+    finally:
+        writer.close()
+        label_writer.close()
+
+    for split_name, count in label_writer.counts.items():
+        print(f"เขียน '{split_name}.txt' เพิ่ม {count} รายการ")
+    return label_writer.counts
+
+
+def write_profile(profiler, path):
+    """บันทึกและพิมพ์สรุปเวลาแต่ละขั้นตอน (ถ้าเปิดการจับเวลาไว้)"""
+    if profiler is None:
+        return
+    profiler.finish()
+    profiler.write_summary(path)
+    print(profiling.format_summary(profiler.summary()))
+    print(f"บันทึกสรุปเวลาแล้ว: {path}")
+
+
+def positive_int(value):
+    """type ของ argparse สำหรับจำนวนเต็มตั้งแต่ 1 ขึ้นไป (ตรวจก่อนเปิดไฟล์ label ใดๆ)"""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"ต้องเป็นจำนวนเต็มตั้งแต่ 1 ขึ้นไป: {value}")
+    return number
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="สร้างชุดข้อมูลรูปภาพตัวอักษรไทยพร้อมอุปสรรค")
+    parser.add_argument("--workers", type=positive_int, default=DEFAULT_WORKERS,
+                        help="จำนวน process ที่ใช้สร้างภาพ (ค่าเริ่มต้น: จำนวน CPU)")
+    parser.add_argument("--chunksize", type=positive_int, default=DEFAULT_CHUNKSIZE,
+                        help="จำนวนงานที่ส่งให้ worker ต่อครั้ง")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="seed หลัก (ถ้าไม่ระบุจะสุ่มให้และพิมพ์ออกมา)")
+    parser.add_argument("--bg-dir", default=BACKGROUND_DIR,
+                        help="โฟลเดอร์ภาพพื้นหลัง (โหลดทุกภาพครั้งเดียวตอนเริ่ม)")
+    parser.add_argument("--bg-crop-scale", type=float, default=1.0,
+                        help="เก็บพื้นหลังใหญ่กว่าขนาดภาพกี่เท่า เพื่อสุ่มตำแหน่ง crop (1.0 = ไม่ crop)")
+    parser.add_argument("--bg-cache", default=None,
+                        help="ไฟล์ .npy สำหรับเก็บคลังพื้นหลัง แล้ว memory-map ใช้ร่วมกันทุก worker (สร้างใหม่เมื่อภาพต้นทางหรือ --bg-crop-scale เปลี่ยน)")
+    parser.add_argument("--stream", action="store_true",
+                        help="โหมด streaming: เขียน label ทีละภาพ, แบ่ง split ด้วย hash และบันทึก checkpoint")
+    parser.add_argument("--resume", action="store_true",
+                        help="(โหมด streaming) รันต่อจาก checkpoint ในโฟลเดอร์ labels")
+    parser.add_argument("--checkpoint-every", type=positive_int, default=DEFAULT_CHECKPOINT_EVERY,
+                        help="(โหมด streaming) บันทึก checkpoint ทุกกี่ภาพ")
+    parser.add_argument("--output-format", choices=OUTPUT_FORMATS, default='folder',
+                        help="folder = หนึ่งไฟล์ต่อภาพ, tar = shard แบบ WebDataset, lmdb = ฐานข้อมูล LMDB")
+    parser.add_argument("--output", default=None,
+                        help="โฟลเดอร์/ฐานข้อมูลปลายทาง (ค่าเริ่มต้นขึ้นกับ --output-format)")
+    parser.add_argument("--shard-size", type=positive_int, default=DEFAULT_SHARD_SIZE,
+                        help="จำนวนภาพต่อ shard สำหรับ --output-format tar")
+    parser.add_argument("--image-format", choices=IMAGE_FORMATS, default='png',
+                        help="รูปแบบการเข้ารหัสภาพ (raw = array uint8 แบบ .npy)")
+    parser.add_argument("--quality", type=int, default=DEFAULT_QUALITY,
+                        help="คุณภาพสำหรับ jpeg/webp")
+    parser.add_argument("--png-compress-level", type=int, default=DEFAULT_PNG_COMPRESS_LEVEL,
+                        help="ระดับการบีบอัด PNG 0-9 (ค่าน้อยเขียนเร็วกว่า)")
+    parser.add_argument("--mask-cache-mb", type=int, default=TEXT_MASK_CACHE_BYTES // (1024 * 1024),
+                        help="ขนาดสูงสุด (MB) ของ cache mask ตัวหนังสือต่อ process")
+    parser.add_argument("--profile", default=None, metavar="PATH",
+                        help="จับเวลาแต่ละขั้นตอนของทุกภาพ แล้วบันทึกสรุป (JSON) ลงไฟล์นี้")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
 
-# --- Main execution ---
-if __name__ == "__main__":
     if not os.path.exists(TEXT_FILE):
         print(f"Error: The text file '{TEXT_FILE}' was not found.")
-    elif not os.path.exists(FONT_PATH):
+        return
+    if not os.path.exists(FONT_PATH):
         print(f"Error: The font file '{FONT_PATH}' was not found.")
-    elif not os.path.exists(BACKGROUND_IMAGE_PATH):
-        print(f"Error: The background image '{BACKGROUND_IMAGE_PATH}' was not found. Please check the 'BG' folder and file name.")
-    else:
-        with open(TEXT_FILE, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-
-        generated_data = []
-        for i, line in enumerate(lines):
-            clean_line = line.strip()
-            if clean_line:
-                relative_path, text_content = generate_image_with_obstacles(
-                    clean_line, FONT_PATH, BACKGROUND_IMAGE_PATH, OUTPUT_FOLDER, i + 1
-                )
-                if relative_path and text_content:
-                    generated_data.append((relative_path, text_content))
-
-        random.shuffle(generated_data) 
-
-        total_samples = len(generated_data)
-        train_count = math.ceil(total_samples * 0.70) 
-        val_count = math.ceil(total_samples * 0.20)
-        test_count = total_samples - train_count - val_count
-        
-        if test_count < 0:
-            test_count = 0
-            if train_count + val_count > total_samples:
-                val_count = total_samples - train_count
-                if val_count < 0:
-                    val_count = 0
-                    train_count = total_samples 
-
-        train_data = generated_data[:train_count]
-        val_data = generated_data[train_count : train_count + val_count]
-        test_data = generated_data[train_count + val_count :] 
-
-        labels_folder = "labels"
-        os.makedirs(labels_folder, exist_ok=True)
+        return
+    if not os.path.isdir(args.bg_dir):
+        print(f"Error: The background folder '{args.bg_dir}' was not found. Please check the 'BG' folder.")
+        return
+
+    seed = args.seed
+    if seed is None and args.stream and args.resume:
+        # รันต่อด้วย seed เดิมจาก checkpoint เพื่อให้ภาพและการแบ่ง split ต่อเนื่องกัน
+        checkpoint = StreamingLabelWriter.read_checkpoint(LABELS_FOLDER)
+        if checkpoint is not None:
+            seed = checkpoint['seed']
+    if seed is None:
+        seed = random.randrange(2**32)
+    print(f"ใช้ seed: {seed} (workers={args.workers})")
+
+    background_pool = load_background_pool(args.bg_dir, args.bg_crop_scale, args.bg_cache)
+    print(f"โหลดภาพพื้นหลังแล้ว {len(background_pool)} ภาพ")
+
+    output_path = args.output or DEFAULT_OUTPUT_PATHS[args.output_format]
+    encoding = (args.image_format, args.quality, args.png_compress_level)
+    mask_cache_bytes = args.mask_cache_mb * 1024 * 1024
+    profiler = profiling.StageProfiler() if args.profile else None
+
+    if args.stream:
+        make_tasks = functools.partial(iter_file_tasks, TEXT_FILE, FONT_PATH, seed, encoding)
+        run_streaming(
+            make_tasks, background_pool, args.output_format, output_path, LABELS_FOLDER, seed,
+            workers=args.workers, chunksize=args.chunksize, resume=args.resume,
+            checkpoint_every=args.checkpoint_every, shard_size=args.shard_size,
+            mask_cache_bytes=mask_cache_bytes, profiler=profiler,
+        )
+        write_profile(profiler, args.profile)
+        return
 
-        with open(os.path.join(labels_folder, "train.txt"), 'w', encoding='utf-8') as f:
-            for path, text in train_data:
-                f.write(f"{path}\t{text}\n")
-        print(f"สร้างไฟล์ 'train.txt' แล้ว ({len(train_data)} รายการ)")
+    with open(TEXT_FILE, 'r', encoding='utf-8') as f:
+        lines = f.readlines()
+
+    writer = create_writer(args.output_format, output_path, shard_size=args.shard_size)
+    try:
+        generated_data = generate_all(
+            lines, FONT_PATH, background_pool, writer, seed,
+            workers=args.workers, chunksize=args.chunksize, encoding=encoding,
+            mask_cache_bytes=mask_cache_bytes, profiler=profiler,
+        )
+    finally:
+        writer.close()
+    write_profile(profiler, args.profile)
+
+    train_data, val_data, test_data = split_dataset(generated_data, seed)
+    write_labels(LABELS_FOLDER, "train", train_data)
+    write_labels(LABELS_FOLDER, "val", val_data)
+    write_labels(LABELS_FOLDER, "test", test_data)
 
-        with open(os.path.join(labels_folder, "val.txt"), 'w', encoding='utf-8') as f:
-            for path, text in val_data:
-                f.write(f"{path}\t{text}\n")
-        print(f"สร้างไฟล์ 'val.txt' แล้ว ({len(val_data)} รายการ)")
 
-        with open(os.path.join(labels_folder, "test.txt"), 'w', encoding='utf-8') as f:
-            for path, text in test_data:
-                f.write(f"{path}\t{text}\n")
-        print(f"สร้างไฟล์ 'test.txt' แล้ว ({len(test_data)} รายการ)")
\ No newline at end of file
+# --- Main execution ---
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+import argparse
+import dataclasses
+import functools
+import glob
+import json
+import random
+import sys
+
+import generate_images
+import profiling
+from dataset_writers import DEFAULT_PNG_COMPRESS_LEVEL, DEFAULT_QUALITY, DEFAULT_SHARD_SIZE, IMAGE_FORMATS
+from font_metrics import build_metrics_index
+
+
+@dataclasses.dataclass
+class JobConfig:
+    """
+    สเปกของงานสร้างชุดข้อมูลหนึ่งงาน อ่านจากไฟล์ JSON ด้วย load_job_config (ดูตัวอย่างที่ job_example.json)
+    พาธทั้งหมดอ้างอิงจากโฟลเดอร์ที่รันคำสั่ง เหมือนตัวเลือกของ generate_images.py
+    """
+    # ไฟล์ฟอนต์ (ใช้ glob ได้ เช่น "fonts/*.ttf")
+    fonts: list
+    # ไฟล์ข้อความต้นทาง อ่านต่อกันตามลำดับ หนึ่งบรรทัดต่อหนึ่งคำ
+    text_sources: list
+    background_dirs: list = dataclasses.field(default_factory=lambda: [generate_images.BACKGROUND_DIR])
+    # จำนวนภาพต่อหนึ่งบรรทัด (แต่ละภาพสุ่มฟอนต์และกลุ่มขนาดของตัวเอง)
+    samples_per_line: int = 1
+    # กลุ่มขนาดตัวหนังสือ [{"font_size": [ต่ำสุด, สูงสุด], "weight": น้ำหนัก}, ...]
+    # ขอบบนต้องไม่เกิน augmentation.max_font_size และถ้าว่างจะใช้ augmentation.font_size กลุ่มเดียว
+    size_classes: list = dataclasses.field(default_factory=list)
+    augmentation: generate_images.AugmentationParams = generate_images.DEFAULT_AUGMENTATION
+    output_format: str = 'folder'
+    output_path: str = None
+    labels_folder: str = generate_images.LABELS_FOLDER
+    image_format: str = 'png'
+    quality: int = DEFAULT_QUALITY
+    png_compress_level: int = DEFAULT_PNG_COMPRESS_LEVEL
+    shard_size: int = DEFAULT_SHARD_SIZE
+    seed: int = None
+    workers: int = generate_images.DEFAULT_WORKERS
+    chunksize: int = generate_images.DEFAULT_CHUNKSIZE
+    checkpoint_every: int = generate_images.DEFAULT_CHECKPOINT_EVERY
+    bg_crop_scale: float = 1.0
+    bg_cache: str = None
+    mask_cache_mb: int = generate_images.TEXT_MASK_CACHE_BYTES // (1024 * 1024)
+    # ไฟล์ JSON สำหรับเก็บตารางขนาดฟอนต์ เพื่อไม่ต้องวัดใหม่ทุกครั้งที่รัน
+    metrics_cache: str = None
+
+    @property
+    def encoding(self):
+        return (self.image_format, self.quality, self.png_compress_level)
+
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _check_font_size_range(font_size, name):
+    """ตรวจว่าช่วงขนาดตัวหนังสือเป็นจำนวนเต็ม [ต่ำสุด, สูงสุด] ที่ MIN_FONT_SIZE <= ต่ำสุด <= สูงสุด"""
+    if (not isinstance(font_size, (list, tuple)) or len(font_size) != 2
+            or not all(_is_int(value) for value in font_size)):
+        raise ValueError(f"{name}: font_size ต้องเป็นจำนวนเต็มสองค่า [ต่ำสุด, สูงสุด]")
+    lower, upper = font_size
+    if lower < generate_images.MIN_FONT_SIZE or lower > upper:
+        raise ValueError(f"{name}: font_size {list(font_size)} ต้องมี "
+                         f"{generate_images.MIN_FONT_SIZE} <= ต่ำสุด <= สูงสุด")
+
+
+def load_job_config(path):
+    """
+    อ่านและตรวจสอบไฟล์ job config (JSON)
+
+    Args:
+        path (str): พาธไฟล์ config
+    Returns:
+        JobConfig: สเปกของงาน
+    Raises:
+        ValueError: ถ้ามีค่าที่ไม่รู้จักหรือค่าไม่ถูกต้อง
+        FileNotFoundError: ถ้าไม่พบไฟล์ฟอนต์จากรูปแบบที่ระบุ
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    known = {field.name for field in dataclasses.fields(JobConfig)}
+    unknown = sorted(set(data) - known)
+    if unknown:
+        raise ValueError(f"ไม่รู้จักค่าใน job config: {', '.join(unknown)}")
+    for required in ('fonts', 'text_sources'):
+        if not data.get(required):
+            raise ValueError(f"job config ต้องระบุ '{required}'")
+
+    augmentation = data.get('augmentation', {})
+    augmentation_fields = {field.name for field in dataclasses.fields(generate_images.AugmentationParams)}
+    unknown = sorted(set(augmentation) - augmentation_fields)
+    if unknown:
+        raise ValueError(f"ไม่รู้จักค่าใน augmentation: {', '.join(unknown)}")
+    # JSON ไม่มี tuple จึงแปลงช่วงค่ากลับเป็น tuple ให้เหมือนค่าเริ่มต้น
+    data['augmentation'] = generate_images.AugmentationParams(
+        **{name: tuple(value) if isinstance(value, list) else value for name, value in augmentation.items()})
+
+    fonts = []
+    for pattern in data['fonts']:
+        matches = sorted(glob.glob(pattern))
+        if not matches:
+            raise FileNotFoundError(f"ไม่พบไฟล์ฟอนต์: {pattern}")
+        fonts.extend(path for path in matches if path not in fonts)
+    data['fonts'] = fonts
+
+    for name in ('samples_per_line', 'checkpoint_every', 'workers', 'chunksize', 'shard_size'):
+        value = data.get(name, 1)
+        if not _is_int(value) or value < 1:
+            raise ValueError(f"{name} ต้องเป็นจำนวนเต็มตั้งแต่ 1 ขึ้นไป: {value}")
+
+    # ตรวจช่วงขนาดตั้งแต่ตอนโหลด ไม่เช่นนั้นทุกภาพจะ error ใน rng.randint ระหว่างการรัน
+    _check_font_size_range(data['augmentation'].font_size, 'augmentation.font_size')
+    max_font_size = data['augmentation'].max_font_size
+    for size_class in data.get('size_classes', []):
+        weight = size_class.get('weight', 1)
+        if not isinstance(weight, (int, float)) or isinstance(weight, bool) or weight <= 0:
+            raise ValueError(f"size_classes ไม่ถูกต้อง: {size_class}")
+        _check_font_size_range(size_class.get('font_size'), f"size_classes {size_class}")
+        # ขนาดที่เกิน max_font_size ถูกลดลงมาใกล้ max_font_size การกระจายของกลุ่มจึงไม่ตรงกับที่ตั้งไว้
+        if size_class['font_size'][1] > max_font_size:
+            raise ValueError(f"size_classes {size_class['font_size']} เกิน augmentation.max_font_size ({max_font_size})")
+
+    if data.get('output_format', 'folder') not in generate_images.OUTPUT_FORMATS:
+        raise ValueError(f"ไม่รองรับรูปแบบเอาต์พุต: {data['output_format']}")
+    if data.get('image_format', 'png') not in IMAGE_FORMATS:
+        raise ValueError(f"ไม่รองรับรูปแบบภาพ: {data['image_format']}")
+    return JobConfig(**data)
+
+
+def iter_text_lines(text_sources):
+    """อ่านทุกบรรทัดจากไฟล์ข้อความต้นทางต่อกันตามลำดับ (ทีละบรรทัด)"""
+    for text_source in text_sources:
+        with open(text_source, 'r', encoding='utf-8') as f:
+            yield from f
+
+
+def size_class_params(job):
+    """
+    Returns:
+        tuple: (params, weights) AugmentationParams ของแต่ละกลุ่มขนาดและน้ำหนักของการสุ่ม
+    """
+    if not job.size_classes:
+        return [job.augmentation], [1]
+    params = [dataclasses.replace(job.augmentation, font_size=tuple(size_class['font_size']))
+              for size_class in job.size_classes]
+    return params, [size_class.get('weight', 1) for size_class in job.size_classes]
+
+
+def iter_job_tasks(job, metrics_index, seed, start_index=0):
+    """
+    สร้างงานของ job: แต่ละบรรทัดได้ samples_per_line ภาพ แต่ละภาพสุ่มฟอนต์จากฟอนต์ที่มี glyph ครบทุกตัวอักษร
+    ของคำนั้น และสุ่มกลุ่มขนาดตามน้ำหนัก คำที่ไม่มีฟอนต์ใดแสดงได้จะถูกข้ามตั้งแต่ตอนนี้
+
+    ดัชนีของภาพคำนวณจากตำแหน่งบรรทัด (ไม่ขึ้นกับคำที่ถูกข้าม) การ resume และการแบ่ง split จึงคงที่
+
+    Args:
+        job (JobConfig): สเปกของงาน
+        metrics_index (dict): font_path -> font_metrics.FontMetrics
+        seed (int): seed หลัก
+        start_index (int): ข้ามภาพที่มีดัชนีไม่เกินค่านี้ (ใช้ตอน resume)
+    Yields:
+        tuple: งานสำหรับ generate_images.generate_stream
+    """
+    params, weights = size_class_params(job)
+    for line_number, line in enumerate(iter_text_lines(job.text_sources), start=1):
+        first_index = (line_number - 1) * job.samples_per_line + 1
+        text_line = line.strip()
+        if first_index + job.samples_per_line - 1 <= start_index or not text_line:
+            continue
+        fonts = [font_path for font_path in job.fonts if metrics_index[font_path].can_render(text_line)]
+        if not fonts:
+            print(f"ข้าม: ไม่มีฟอนต์ใดแสดงข้อความ '{text_line}' ได้ครบทุกตัวอักษร")
+            continue
+        for image_index in range(max(first_index, start_index + 1), first_index + job.samples_per_line):
+            # ตัวสุ่มแยกจากตัวสุ่มของการเรนเดอร์ เพื่อให้อุปสรรคของภาพไม่ขึ้นกับจำนวนฟอนต์
+            choice_rng = random.Random(f"{seed}:{image_index}:job")
+            font_path = choice_rng.choice(fonts)
+            sample_params = choice_rng.choices(params, weights)[0]
+            yield (image_index, text_line, font_path, seed, job.encoding, sample_params)
+
+
+def build_job_metrics(job):
+    """วัดตารางขนาดของทุกฟอนต์ใน job จากตัวอักษรทั้งหมดในข้อความต้นทาง"""
+    characters = set()
+    for line in iter_text_lines(job.text_sources):
+        characters.update(line.strip())
+    return build_metrics_index(job.fonts, characters, job.metrics_cache)
+
+
+def run_job(job, resume=False, profiler=None):
+    """
+    รัน job ในโหมด streaming ของ generate_images (label ทีละภาพ, split ด้วย hash, checkpoint)
+
+    Args:
+        job (JobConfig): สเปกของงาน
+        resume (bool): รันต่อจาก checkpoint ในโฟลเดอร์ labels ของ job
+        profiler (profiling.StageProfiler, optional): ถ้าระบุจะจับเวลาแต่ละขั้นตอนของทุกภาพ
+    Returns:
+        dict: จำนวนรายการที่เขียนในแต่ละ split ระหว่างการรันครั้งนี้
+    """
+    seed = job.seed
+    if seed is None and resume:
+        checkpoint = generate_images.StreamingLabelWriter.read_checkpoint(job.labels_folder)
+        if checkpoint is not None:
+            seed = checkpoint['seed']
+    if seed is None:
+        seed = random.randrange(2**32)
+    print(f"ใช้ seed: {seed} (workers={job.workers})")
+
+    metrics_index = build_job_metrics(job)
+    for font_path, metrics in metrics_index.items():
+        if metrics.missing:
+            print(f"ฟอนต์ '{font_path}' ไม่มี glyph: {''.join(sorted(metrics.missing))}")
+    print(f"วัดตารางขนาดฟอนต์แล้ว {len(metrics_index)} ฟอนต์")
+
+    background_pool = generate_images.load_background_pool(job.background_dirs, job.bg_crop_scale, job.bg_cache)
+    print(f"โหลดภาพพื้นหลังแล้ว {len(background_pool)} ภาพ")
+
+    output_path = job.output_path or generate_images.DEFAULT_OUTPUT_PATHS[job.output_format]
+    return generate_images.run_streaming(
+        functools.partial(iter_job_tasks, job, metrics_index, seed), background_pool, job.output_format,
+        output_path, job.labels_folder, seed,
+        workers=job.workers, chunksize=job.chunksize, resume=resume, checkpoint_every=job.checkpoint_every,
+        shard_size=job.shard_size, mask_cache_bytes=job.mask_cache_mb * 1024 * 1024,
+        profiler=profiler, font_metrics=metrics_index,
+    )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="สร้างชุดข้อมูลหลายฟอนต์/หลายกลุ่มขนาดตาม job config (JSON)")
+    parser.add_argument("config", help="ไฟล์ job config")
+    parser.add_argument("--resume", action="store_true", help="รันต่อจาก checkpoint ในโฟลเดอร์ labels ของ job")
+    parser.add_argument("--profile", default=None, metavar="PATH",
+                        help="จับเวลาแต่ละขั้นตอนของทุกภาพ แล้วบันทึกสรุป (JSON) ลงไฟล์นี้")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    job = load_job_config(args.config)
+    profiler = profiling.StageProfiler() if args.profile else None
+    run_job(job, resume=args.resume, profiler=profiler)
+    generate_images.write_profile(profiler, args.profile)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
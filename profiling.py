@@ -0,0 +1,142 @@
+import json
+import math
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# ข้อมูลเวลาของภาพที่กำลังสร้างใน process นี้ (None = ไม่ได้เปิดการจับเวลา)
+_current_timings = None
+_last_lap = 0.0
+
+
+def start_sample_timing():
+    """เริ่มเก็บเวลาแต่ละขั้นตอนของภาพถัดไปใน process นี้"""
+    global _current_timings, _last_lap
+    _current_timings = {}
+    _last_lap = time.perf_counter()
+
+
+def finish_sample_timing():
+    """
+    หยุดเก็บเวลาของภาพปัจจุบัน
+
+    Returns:
+        dict: เวลา (วินาที) ของแต่ละขั้นตอน หรือ None ถ้าไม่ได้เริ่มจับเวลา
+    """
+    global _current_timings
+    timings, _current_timings = _current_timings, None
+    return timings
+
+
+def lap(name):
+    """
+    บันทึกเวลาตั้งแต่ lap ครั้งก่อน (หรือตั้งแต่เริ่มภาพ) เป็นเวลาของขั้นตอน name
+    ถ้าไม่ได้เปิดการจับเวลาจะไม่ทำอะไรเลย จึงเรียกทิ้งไว้ในโค้ดปกติได้
+
+    Args:
+        name (str): ชื่อขั้นตอนที่เพิ่งทำเสร็จ เช่น 'warp'
+    """
+    global _last_lap
+    if _current_timings is None:
+        return
+    now = time.perf_counter()
+    _current_timings[name] = _current_timings.get(name, 0.0) + now - _last_lap
+    _last_lap = now
+
+
+def percentile(sorted_values, fraction):
+    """หาค่า percentile แบบ nearest-rank (ค่าลำดับที่ ceil(fraction * n)) จากรายการที่เรียงแล้ว"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def peak_rss_mb():
+    """
+    หาหน่วยความจำสูงสุด (MB) ของ process หลักและ process ลูกที่จบไปแล้ว
+
+    Returns:
+        dict: {'main': MB, 'children': MB} หรือ None ถ้าระบบไม่รองรับ
+    """
+    if resource is None:
+        return None
+    # ru_maxrss บน Linux มีหน่วยเป็น KB
+    return {
+        'main': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'children': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }
+
+
+class StageProfiler:
+    """
+    รวมเวลาแต่ละขั้นตอนจากทุกภาพ (รวมถึงภาพที่สร้างใน worker process) แล้วสรุปเป็น percentile
+    """
+
+    def __init__(self):
+        self.stage_times = {}
+        self.sample_count = 0
+        self.started_at = time.perf_counter()
+        self.finished_at = None
+
+    def add(self, timings):
+        """เพิ่มเวลาของหนึ่งภาพ (dict จาก finish_sample_timing)"""
+        if not timings:
+            return
+        self.sample_count += 1
+        for name, seconds in timings.items():
+            self.stage_times.setdefault(name, []).append(seconds)
+
+    def finish(self):
+        self.finished_at = time.perf_counter()
+
+    def summary(self):
+        """
+        Returns:
+            dict: จำนวนภาพ, เวลารวม, throughput (ภาพ/วินาที), percentile ของแต่ละขั้นตอน (ms) และ peak RSS
+        """
+        elapsed = (self.finished_at or time.perf_counter()) - self.started_at
+        stages = {}
+        for name, values in self.stage_times.items():
+            values = sorted(values)
+            stages[name] = {
+                'count': len(values),
+                'mean_ms': 1000 * sum(values) / len(values),
+                'p50_ms': 1000 * percentile(values, 0.50),
+                'p90_ms': 1000 * percentile(values, 0.90),
+                'p99_ms': 1000 * percentile(values, 0.99),
+                'max_ms': 1000 * values[-1],
+            }
+        return {
+            'samples': self.sample_count,
+            'elapsed_s': elapsed,
+            'images_per_s': self.sample_count / elapsed if elapsed > 0 else 0.0,
+            'stages': stages,
+            'peak_rss_mb': peak_rss_mb(),
+        }
+
+    def write_summary(self, path):
+        """บันทึกสรุปเป็นไฟล์ JSON"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.summary(), f, indent=2, ensure_ascii=False)
+
+
+def format_summary(summary):
+    """จัดรูปแบบสรุปเป็นตารางข้อความสำหรับพิมพ์"""
+    lines = [
+        f"ภาพทั้งหมด: {summary['samples']}  เวลา: {summary['elapsed_s']:.2f} s  "
+        f"throughput: {summary['images_per_s']:.1f} ภาพ/s",
+        f"{'stage':<16}{'mean':>9}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}  (ms)",
+    ]
+    for name, stats in summary['stages'].items():
+        lines.append(
+            f"{name:<16}{stats['mean_ms']:>9.2f}{stats['p50_ms']:>9.2f}{stats['p90_ms']:>9.2f}"
+            f"{stats['p99_ms']:>9.2f}{stats['max_ms']:>9.2f}"
+        )
+    rss = summary['peak_rss_mb']
+    if rss is not None:
+        lines.append(f"peak RSS: main {rss['main']:.1f} MB, workers {rss['children']:.1f} MB")
+    return "\n".join(lines)